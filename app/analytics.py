@@ -0,0 +1,217 @@
+# Дневные итоги по товарам (item_daily_stats). Обновляются в той же транзакции, что и заказы
+# (app/booking.py), поэтому дашборд читает только их. Пересчёт с нуля: python -m app.analytics
+import math
+import sys
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, text, update
+
+from .database import SessionLocal
+from .models import Item, ItemDailyStats, Order, OrderArchive
+from .statuses import BOOKED_ORDER_STATUSES, ORDER_STATUS_LABELS
+from .utils import calculate_rental_price
+
+STAT_FIELDS = ("order_count", "units", "booked_hours", "revenue")
+PRICE_COLUMNS = (Item.id, Item.price_per_hour, Item.price_per_3h, Item.price_per_day, Item.price_per_week)
+
+StatKey = Tuple[str, int, int]
+
+
+def load_prices(db, item_ids: Iterable[int] = ()) -> Dict[int, object]:
+    # только тарифы: полная загрузка Item подтянула бы картинки и все заказы
+    query = db.query(*PRICE_COLUMNS)
+    ids = set(item_ids)
+    if ids:
+        query = query.filter(Item.id.in_(ids))
+    return {row.id: row for row in query}
+
+
+def price_order(order, prices) -> Tuple[int, int]:
+    # (сумма, часы на все единицы) по текущим тарифам товара; у удалённого товара — нули
+    item = prices.get(order.item_id)
+    if item is None:
+        return 0, 0
+    start_at = order.start_at or f"{order.date_from} 00:00"
+    end_at = order.end_at or f"{order.date_to} 00:00"
+    qty = order.qty or 1
+    amount, start_dt, end_dt, _ = calculate_rental_price(item, start_at, end_at, qty)
+    hours = max(1, math.ceil((end_dt - start_dt).total_seconds() / 3600))
+    return amount, hours * qty
+
+
+def fill_booked_amounts(db, orders) -> None:
+    # Фиксирует сумму и часы заказа при бронировании; дальше итоги считаются только по ним
+    missing = [order for order in orders if order.booked_amount is None]
+    if not missing:
+        return
+    prices = load_prices(db, {order.item_id for order in missing})
+    for order in missing:
+        order.booked_amount, order.booked_hours = price_order(order, prices)
+
+
+def backfill_booked_amounts(db) -> int:
+    # Заказам, созданным до появления booked_amount, сумма фиксируется по текущим тарифам —
+    # так же, как их уже посчитали дневные итоги. Коммит — за вызывающим.
+    prices = load_prices(db)
+    total = 0
+    for model in (Order, OrderArchive):
+        pk = model.__mapper__.primary_key[0]
+        rows = (
+            db.query(pk, model.item_id, model.start_at, model.end_at, model.date_from, model.date_to, model.qty)
+            .filter(model.booked_amount.is_(None))
+            .all()
+        )
+        values = []
+        for row in rows:
+            amount, hours = price_order(row, prices)
+            values.append({pk.key: row[0], "booked_amount": amount, "booked_hours": hours})
+        if values:
+            db.execute(update(model), values)
+        total += len(values)
+    return total
+
+
+def order_stats(order, prices) -> Tuple[StatKey, Tuple[int, int, int, int]]:
+    # Сумма и часы — зафиксированные при бронировании; текущие тарифы (prices) нужны только
+    # заказам, созданным до появления booked_amount
+    start_at = order.start_at or f"{order.date_from} 00:00"
+    if order.booked_amount is not None:
+        revenue, hours = order.booked_amount, order.booked_hours or 0
+    else:
+        revenue, hours = price_order(order, prices)
+    return (start_at[:10], order.item_id, order.status_code), (1, order.qty or 1, hours, revenue)
+
+
+def add_stats(totals: Dict[StatKey, List[int]], key: StatKey, values, sign: int = 1) -> None:
+    current = totals.setdefault(key, [0, 0, 0, 0])
+    for idx, value in enumerate(values):
+        current[idx] += sign * value
+
+
+def apply_order_stats(db, orders, sign: int = 1) -> None:
+    # sign=1 — заказы добавлены (или получили новый статус), -1 — удалены (или уходят из старого).
+    # Счётчики меняются выражением col = col + delta: параллельные транзакции не теряют обновления.
+    if not orders:
+        return
+    legacy = {order.item_id for order in orders if order.booked_amount is None}
+    prices = load_prices(db, legacy) if legacy else {}
+    deltas: Dict[StatKey, List[int]] = {}
+    for order in orders:
+        key, values = order_stats(order, prices)
+        add_stats(deltas, key, values, sign)
+    for (day, item_id, status_code), values in deltas.items():
+        result = db.execute(
+            update(ItemDailyStats)
+            .where(
+                ItemDailyStats.day == day,
+                ItemDailyStats.item_id == item_id,
+                ItemDailyStats.status_code == status_code,
+            )
+            .values({name: getattr(ItemDailyStats, name) + value for name, value in zip(STAT_FIELDS, values)})
+            .execution_options(synchronize_session=False)
+        )
+        if not result.rowcount:
+            db.execute(
+                insert(ItemDailyStats).values(
+                    day=day, item_id=item_id, status_code=status_code, **dict(zip(STAT_FIELDS, values))
+                )
+            )
+
+
+def lock_stats_tables(db) -> None:
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("BEGIN IMMEDIATE"))
+        return
+    # чтение не ждёт; запись заказов и итогов, как и второй пересчёт, ждёт окончания этого
+    quote = db.get_bind().dialect.identifier_preparer.quote
+    tables = ", ".join(quote(model.__tablename__) for model in (Order, OrderArchive, ItemDailyStats))
+    db.execute(text(f"LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE"))
+
+
+def rebuild_stats() -> int:
+    # Пересчёт по заказам и архиву; строки читаются порциями, в памяти — только итоги по дням
+    totals: Dict[StatKey, List[int]] = {}
+    with SessionLocal() as db:
+        # блокировка до чтения: брони и смены статусов, закоммиченные во время пересчёта,
+        # иначе попали бы в итоги, которые затем стираются
+        lock_stats_tables(db)
+        prices = load_prices(db)
+        for model in (OrderArchive, Order):
+            rows = db.query(
+                model.item_id,
+                model.status_code,
+                model.start_at,
+                model.end_at,
+                model.date_from,
+                model.date_to,
+                model.qty,
+                model.booked_amount,
+                model.booked_hours,
+            ).execution_options(yield_per=1000)
+            for row in rows:
+                key, values = order_stats(row, prices)
+                add_stats(totals, key, values)
+        db.query(ItemDailyStats).delete(synchronize_session=False)
+        if totals:
+            db.execute(
+                insert(ItemDailyStats),
+                [
+                    {"day": day, "item_id": item_id, "status_code": status_code, **dict(zip(STAT_FIELDS, values))}
+                    for (day, item_id, status_code), values in totals.items()
+                ],
+            )
+        db.commit()
+    return len(totals)
+
+
+def item_summary(db, days: int, today: Optional[date] = None) -> dict:
+    # Итоги за последние days дней по дням начала аренды: объём чтения зависит от числа товаров
+    # и дней, а не от числа заказов
+    today = today or date.today()
+    since = (today - timedelta(days=days - 1)).isoformat()
+    rows = (
+        db.query(
+            ItemDailyStats.item_id,
+            ItemDailyStats.status_code,
+            func.sum(ItemDailyStats.order_count),
+            func.sum(ItemDailyStats.booked_hours),
+            func.sum(ItemDailyStats.revenue),
+        )
+        .filter(ItemDailyStats.day >= since, ItemDailyStats.day <= today.isoformat())
+        .group_by(ItemDailyStats.item_id, ItemDailyStats.status_code)
+        .all()
+    )
+    items = {row.id: row for row in db.query(Item.id, Item.name, Item.stock)}
+    summary: Dict[int, dict] = {}
+    for item_id, status_code, order_count, booked_hours, revenue in rows:
+        entry = summary.setdefault(
+            item_id,
+            {"item_id": item_id, "by_status": {}, "booked_hours": 0, "revenue": 0},
+        )
+        entry["by_status"][status_code] = order_count
+        if status_code in BOOKED_ORDER_STATUSES:
+            entry["booked_hours"] += booked_hours
+            entry["revenue"] += revenue
+    for entry in summary.values():
+        item = items.get(entry["item_id"])
+        entry["name"] = item.name if item else f"#{entry['item_id']} (удалён)"
+        capacity = days * 24 * (item.stock if item else 1)
+        entry["utilization"] = round(100 * entry["booked_hours"] / capacity, 1) if capacity else 0
+    ordered = sorted(summary.values(), key=lambda entry: entry["revenue"], reverse=True)
+    return {
+        "since": since,
+        "rows": ordered,
+        "statuses": ORDER_STATUS_LABELS,
+        "total_revenue": sum(entry["revenue"] for entry in ordered),
+        "total_hours": sum(entry["booked_hours"] for entry in ordered),
+    }
+
+
+def main() -> int:
+    print(f"Пересчитано строк статистики: {rebuild_stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
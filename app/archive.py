@@ -0,0 +1,115 @@
+# Перенос завершённых заказов из order в order_archive. Горячие запросы (занятость, брони
+# на странице товара) читают только order; история (профиль, выгрузка) объединяет обе таблицы.
+# Запуск вручную: python -m app.archive [--days N]
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+from sqlalchemy import and_, delete, insert, literal, or_, select
+
+from .catalog import change_active_bookings
+from .config import ORDER_ARCHIVE_AFTER_DAYS, ORDER_ARCHIVE_BATCH
+from .database import SessionLocal
+from .models import Item, Order, OrderArchive
+from .statuses import ARCHIVABLE_ORDER_STATUSES
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = (
+    "id",
+    "date_from",
+    "date_to",
+    "status_code",
+    "start_at",
+    "end_at",
+    "payment_id",
+    "payment_code",
+    "hold_expires_at",
+    "qty",
+    "booked_amount",
+    "booked_hours",
+    "user_id",
+    "item_id",
+)
+
+
+def archive_orders(db, order_ids: Sequence[int], now: Optional[datetime] = None) -> int:
+    # Копирует заказы в архив и удаляет из order. Коммит — за вызывающим.
+    if not order_ids:
+        return 0
+    now = now or datetime.utcnow()
+    # брони из архива на карточке товара не считаются
+    archived = db.query(Order.item_id, Order.status_code).filter(Order.id.in_(list(order_ids))).all()
+    change_active_bookings(db, archived, sign=-1)
+    source = (
+        select(*(getattr(Order, name) for name in ARCHIVE_COLUMNS), Item.name, literal(now))
+        .outerjoin(Item, Item.id == Order.item_id)
+        .where(Order.id.in_(list(order_ids)))
+    )
+    db.execute(insert(OrderArchive).from_select([*ARCHIVE_COLUMNS, "item_name", "archived_at"], source))
+    result = db.execute(delete(Order).where(Order.id.in_(list(order_ids))).execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def archivable_ids(db, cutoff: str, after_id: int, limit: int) -> List[int]:
+    # Обход по первичному ключу: каждая порция продолжает с последнего id, таблица читается один раз
+    rows = (
+        db.query(Order.id)
+        .filter(
+            Order.id > after_id,
+            Order.status_code.in_(ARCHIVABLE_ORDER_STATUSES),
+            or_(Order.end_at < cutoff, and_(Order.end_at.is_(None), Order.date_to < cutoff)),
+        )
+        .order_by(Order.id)
+        .limit(limit)
+        .all()
+    )
+    return [row.id for row in rows]
+
+
+def archive_old_orders(
+    days: int = ORDER_ARCHIVE_AFTER_DAYS, batch: int = ORDER_ARCHIVE_BATCH, now: Optional[datetime] = None
+) -> int:
+    if days <= 0:
+        return 0
+    now = now or datetime.utcnow()
+    cutoff = (now - timedelta(days=days)).strftime("%Y-%m-%d")
+    total = 0
+    after_id = 0
+    while True:
+        # каждая порция — отдельная короткая транзакция, бронирование между ними не ждёт
+        with SessionLocal() as db:
+            ids = archivable_ids(db, cutoff, after_id, batch)
+            if not ids:
+                break
+            total += archive_orders(db, ids, now)
+            db.commit()
+        after_id = ids[-1]
+    return total
+
+
+async def order_archiver(interval: float) -> None:
+    while True:
+        try:
+            archived = await asyncio.to_thread(archive_old_orders)
+            if archived:
+                logger.info("archived %s orders", archived, extra={"archived": archived})
+        except Exception:
+            logger.exception("order archiver failed")
+        await asyncio.sleep(interval)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Перенос завершённых заказов в order_archive")
+    parser.add_argument("--days", type=int, default=ORDER_ARCHIVE_AFTER_DAYS, help="возраст заказа в днях")
+    parser.add_argument("--batch", type=int, default=ORDER_ARCHIVE_BATCH, help="размер порции")
+    args = parser.parse_args(argv)
+    print(f"Перенесено в архив: {archive_old_orders(args.days, args.batch)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
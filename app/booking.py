@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+from .analytics import apply_order_stats, fill_booked_amounts
+from .catalog import change_active_bookings
+from .database import SessionLocal
+from .models import Item, Order
+from .statuses import OrderStatus, PaymentStatus
+from .utils import check_item_availability, parse_cart_dt
+
+logger = logging.getLogger(__name__)
+
+
+def _lock_items(db, item_ids: Sequence[int]) -> None:
+    if db.get_bind().dialect.name == "sqlite":
+        # SQLite: сразу берём блокировку записи, чтобы проверка и вставка шли без гонок.
+        # Критическая секция короткая — только SELECT по индексу и INSERT.
+        db.execute(text("BEGIN IMMEDIATE"))
+        return
+    # Остальные СУБД: блокируем строки товаров (по возрастанию id — без взаимоблокировок),
+    # брони разных товаров идут параллельно
+    if not item_ids:
+        return
+    db.query(Item.id).filter(Item.id.in_(sorted(item_ids))).order_by(Item.id).with_for_update().all()
+
+
+def _track_orders(db, orders: Sequence[Order], sign: int = 1) -> None:
+    # дневные итоги и счётчик броней на карточке меняются в одной транзакции со статусами заказов
+    apply_order_stats(db, orders, sign)
+    change_active_bookings(db, orders, sign)
+
+
+def book_orders(orders: List[Order], cart: Sequence[dict] = ()) -> Tuple[List[int], Optional[str]]:
+    # Проверка занятости и вставка заказов в одной транзакции. Возвращает (id заказов, None)
+    # или ([], текст конфликта); при конфликте ничего не сохраняется.
+    with SessionLocal() as db:
+        _lock_items(db, {order.item_id for order in orders})
+        # сумма фиксируется по тарифам на момент брони: смена цен не сдвигает дневные итоги
+        fill_booked_amounts(db, orders)
+        for order in orders:
+            start_dt = parse_cart_dt(order.start_at)
+            end_dt = parse_cart_dt(order.end_at)
+            if not start_dt or not end_dt:
+                db.rollback()
+                return [], "Не удалось разобрать даты аренды. Проверьте период и повторите."
+            # уже добавленные заказы этой же транзакции видны проверке после flush
+            conflict = check_item_availability(order.item_id, start_dt, end_dt, db, list(cart), qty=order.qty or 1)
+            if conflict:
+                db.rollback()
+                return [], conflict
+            db.add(order)
+            db.flush()
+        _track_orders(db, orders)
+        order_ids = [order.id for order in orders]
+        db.commit()
+    return order_ids, None
+
+
+def release_orders(order_ids: Sequence[int]) -> None:
+    if not order_ids:
+        return
+    with SessionLocal() as db:
+        orders = db.query(Order).filter(Order.id.in_(list(order_ids))).all()
+        _track_orders(db, orders, sign=-1)
+        db.query(Order).filter(Order.id.in_(list(order_ids))).delete(synchronize_session=False)
+        db.commit()
+
+
+def settle_payment(payment_id: str, payment_code: PaymentStatus) -> List[int]:
+    # Применяет статус платежа к заказам. Если оплата пришла после истечения удержания,
+    # слот возвращается заказу только если он всё ещё свободен; id заказов, которые
+    # вернуть не удалось (нужен возврат денег), возвращаются вызывающему.
+    lost: List[int] = []
+    with SessionLocal() as db:
+        query = db.query(Order).filter(Order.payment_id == payment_id)
+        orders = query.all()
+        if not orders:
+            return lost
+        _lock_items(db, {order.item_id for order in orders})
+        # после блокировки перечитываем статусы: параллельный возврат с оплаты или фоновая задача
+        # могли их уже изменить; FOR UPDATE — на случай записи, не блокирующей товары
+        orders = query.populate_existing().with_for_update().all()
+        # итоги по старым статусам снимаются, по новым — добавляются ниже
+        _track_orders(db, orders, sign=-1)
+        if payment_code == PaymentStatus.SUCCEEDED:
+            now = datetime.utcnow()
+            for order in orders:
+                expired = order.hold_expires_at is not None and order.hold_expires_at <= now
+                if expired and order.status_code != OrderStatus.PAID:
+                    start_dt = parse_cart_dt(order.start_at)
+                    end_dt = parse_cart_dt(order.end_at)
+                    # просроченное удержание проверкой уже не учитывается — сравниваем с остальными
+                    if not start_dt or not end_dt or check_item_availability(
+                        order.item_id, start_dt, end_dt, db, [], qty=order.qty or 1
+                    ):
+                        order.payment_code = payment_code
+                        order.status_code = OrderStatus.EXPIRED
+                        lost.append(order.id)
+                        continue
+                order.payment_code = payment_code
+                order.status_code = OrderStatus.PAID
+                order.hold_expires_at = None
+                db.flush()
+        else:
+            for order in orders:
+                order.payment_code = payment_code
+                if payment_code == PaymentStatus.CANCELED:
+                    order.status_code = OrderStatus.CANCELED
+        _track_orders(db, orders)
+        db.commit()
+    if lost:
+        logger.error(
+            "payment %s succeeded after hold expired, slot taken: orders %s",
+            payment_id,
+            lost,
+            extra={"payment_id": payment_id, "order_ids": lost},
+        )
+    return lost
+
+
+def expire_stale_holds(now: Optional[datetime] = None) -> int:
+    # Снимает просроченные удержания одним UPDATE. Проверка занятости их и так не учитывает,
+    # здесь только обновляется статус для профиля и админки (и дневные итоги).
+    now = now or datetime.utcnow()
+    stale = (
+        Order.payment_code == PaymentStatus.PENDING,
+        Order.hold_expires_at < now,
+        Order.status_code == OrderStatus.AWAITING_PAYMENT,
+    )
+    with SessionLocal() as db:
+        item_ids = {row.item_id for row in db.query(Order.item_id).filter(*stale).distinct()}
+    if not item_ids:
+        return 0
+    with SessionLocal() as db:
+        # те же блокировки товаров, что у settle_payment: оплата и истечение одного заказа
+        # не применяются одновременно, статус перечитывается уже под блокировкой
+        _lock_items(db, item_ids)
+        orders = db.query(Order).filter(*stale, Order.item_id.in_(item_ids)).with_for_update().all()
+        if not orders:
+            db.rollback()
+            return 0
+        _track_orders(db, orders, sign=-1)
+        db.query(Order).filter(Order.id.in_([order.id for order in orders])).update(
+            {Order.status_code: OrderStatus.EXPIRED}, synchronize_session="evaluate"
+        )
+        _track_orders(db, orders)
+        db.commit()
+    return len(orders)
+
+
+async def hold_sweeper(interval: float) -> None:
+    while True:
+        try:
+            expired = await asyncio.to_thread(expire_stale_holds)
+            if expired:
+                logger.info("expired %s payment holds", expired, extra={"expired": expired})
+        except Exception:
+            logger.exception("hold sweeper failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,217 @@
+from collections import Counter
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, tuple_, update
+
+from .invalidation import on_invalidate, publish
+from .models import Item, ItemImage, Order
+from .statuses import BOOKED_ORDER_STATUSES
+from .uploads import change_upload_refs
+from .utils import parse_int_field
+
+PRICE_FIELDS = ("price_per_hour", "price_per_3h", "price_per_day", "price_per_week")
+
+CATALOG_PAGE_SIZE = 24
+CATALOG_SORTS = ("", "price_asc", "price_desc", "newest")
+# тариф для фильтра и сортировки по цене; без тарифа — минимальная цена товара
+TARIFF_COLUMNS = {
+    "": Item.min_price,
+    "hour": Item.price_per_hour,
+    "day": Item.price_per_day,
+    "week": Item.price_per_week,
+}
+CARD_COLUMNS = (Item.id, Item.name, Item.short_description, Item.min_price, Item.cover_image_url)
+
+
+def clean_item_data(data: dict, category_ids: Collection[int]) -> Tuple[Optional[dict], Optional[str]]:
+    # Общие правила для формы товара и массового импорта: (значения колонок, None) или (None, ошибка)
+    values = {
+        "name": str(data.get("name") or "").strip(),
+        "short_description": str(data.get("short_description") or "").strip(),
+        "description": str(data.get("description") or "").strip(),
+    }
+    for field in PRICE_FIELDS:
+        values[field] = parse_int_field(data.get(field, "0"))
+    values["stock"] = max(1, parse_int_field(data.get("stock", "1"), default=1))
+    category_raw = str(data.get("category_id") or "").strip()
+
+    if not (values["name"] and values["short_description"] and values["description"] and category_raw):
+        return None, "Заполните все поля."
+    if not any(values[field] for field in PRICE_FIELDS):
+        return None, "Укажите хотя бы одну цену."
+    category_id = parse_int_field(category_raw)
+    if category_id not in category_ids:
+        return None, "Неизвестная категория."
+    values["category_id"] = category_id
+    values["min_price"] = card_min_price(values)
+    values["search_text"] = card_search_text(values)
+    return values, None
+
+
+def card_min_price(values) -> Optional[int]:
+    prices = [values[field] for field in PRICE_FIELDS if values[field] and values[field] > 0]
+    return min(prices) if prices else None
+
+
+def card_search_text(values) -> str:
+    # lower() в SQLite не понижает кириллицу, поэтому текст для поиска хранится уже в нижнем регистре
+    return " ".join(values[field] or "" for field in ("name", "short_description", "description")).lower()
+
+
+def parse_catalog_cursor(raw: str, by_price: bool) -> Optional[Tuple[int, ...]]:
+    # "цена.id" для сортировки по цене, "id" для остальных; мусор — первая страница
+    try:
+        parts = tuple(int(part) for part in raw.split("."))
+    except ValueError:
+        return None
+    return parts if len(parts) == (2 if by_price else 1) else None
+
+
+def catalog_query(
+    db,
+    category_id: Optional[int] = None,
+    q: str = "",
+    sort: str = "",
+    tariff: str = "",
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    after: str = "",
+):
+    # Фильтры и сортировка выполняются в SQL. Страницы — по ключу (keyset): следующая начинается
+    # после последней пары (цена, id), без OFFSET.
+    price = TARIFF_COLUMNS.get(tariff, Item.min_price)
+    by_price = sort in ("price_asc", "price_desc")
+    query = db.query(*CARD_COLUMNS)
+    if category_id is not None:
+        query = query.filter(Item.category_id == category_id)
+    for word in q.split():
+        query = query.filter(Item.search_text.contains(word, autoescape=True))
+    if tariff or by_price or min_price is not None or max_price is not None:
+        # товары без цены в выбранном тарифе в ценовой выборке не участвуют
+        query = query.filter(price > 0)
+    if min_price is not None:
+        query = query.filter(price >= min_price)
+    if max_price is not None:
+        query = query.filter(price <= max_price)
+
+    cursor = parse_catalog_cursor(after, by_price) if after else None
+    if sort == "price_asc":
+        if cursor:
+            query = query.filter(tuple_(price, Item.id) > tuple_(*cursor))
+        query = query.order_by(price, Item.id)
+    elif sort == "price_desc":
+        if cursor:
+            query = query.filter(tuple_(price, Item.id) < tuple_(*cursor))
+        query = query.order_by(price.desc(), Item.id.desc())
+    elif sort == "newest":
+        if cursor:
+            query = query.filter(Item.id < cursor[0])
+        query = query.order_by(Item.id.desc())
+    else:
+        if cursor:
+            query = query.filter(Item.id > cursor[0])
+        query = query.order_by(Item.id)
+    return query.add_columns(price.label("sort_price"))
+
+
+def catalog_page(db, sort: str = "", after: str = "", limit: int = CATALOG_PAGE_SIZE, **filters):
+    # Возвращает (товары, курсор следующей страницы или None)
+    query = catalog_query(db, sort=sort, after=after, **filters)
+    # одна лишняя строка показывает, есть ли следующая страница
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        by_price = sort in ("price_asc", "price_desc")
+        next_cursor = f"{last.sort_price}.{last.id}" if by_price else str(last.id)
+    return rows[:limit], next_cursor
+
+
+def sync_item_images(db, item_id: int, urls: List[str]) -> bool:
+    # Приводит картинки товара к списку urls: добавленные вставляются, убранные удаляются,
+    # у оставшихся меняется только position — их id не меняются. Возвращает, было ли изменение.
+    existing = (
+        db.query(ItemImage)
+        .filter(ItemImage.item_id == item_id)
+        .order_by(ItemImage.position, ItemImage.id)
+        .all()
+    )
+    unused: Dict[str, List[ItemImage]] = {}
+    for image in existing:
+        unused.setdefault(image.url, []).append(image)
+    added: List[str] = []
+    moved = False
+    for position, url in enumerate(urls):
+        matches = unused.get(url)
+        if matches:
+            image = matches.pop(0)
+            if image.position != position:
+                image.position = position
+                moved = True
+        else:
+            db.add(ItemImage(url=url, item_id=item_id, position=position))
+            added.append(url)
+    removed = [image for images in unused.values() for image in images]
+    for image in removed:
+        db.delete(image)
+    change_upload_refs(db, added=added, removed=[image.url for image in removed])
+    db.query(Item).filter(Item.id == item_id).update(
+        {Item.cover_image_url: urls[0] if urls else None, Item.image_count: len(urls)}
+    )
+    return moved or bool(added) or bool(removed)
+
+
+def change_active_bookings(db, orders: Iterable, sign: int = 1) -> None:
+    # Счётчик броней на карточке: заказы в статусах занятости, ещё не ушедшие в архив
+    delta = Counter(order.item_id for order in orders if order.status_code in BOOKED_ORDER_STATUSES)
+    for item_id, count in delta.items():
+        db.query(Item).filter(Item.id == item_id).update(
+            {Item.active_booking_count: Item.active_booking_count + sign * count}, synchronize_session=False
+        )
+
+
+def rebuild_card_fields(db) -> None:
+    # Пересчёт полей карточек с нуля: после добавления колонок и для демоданных. Коммит — за вызывающим.
+    images: Dict[int, List[str]] = {}
+    for item_id, url in db.query(ItemImage.item_id, ItemImage.url).order_by(
+        ItemImage.item_id, ItemImage.position, ItemImage.id
+    ):
+        images.setdefault(item_id, []).append(url)
+    bookings = dict(
+        db.query(Order.item_id, func.count(Order.id))
+        .filter(Order.status_code.in_(BOOKED_ORDER_STATUSES))
+        .group_by(Order.item_id)
+        .all()
+    )
+    columns = [Item.id, Item.name, Item.short_description, Item.description]
+    columns += [getattr(Item, field) for field in PRICE_FIELDS]
+    rows = []
+    for row in db.query(*columns):
+        values = row._asdict()
+        urls = images.get(row.id, [])
+        rows.append(
+            {
+                "id": row.id,
+                "min_price": card_min_price(values),
+                "search_text": card_search_text(values),
+                "cover_image_url": urls[0] if urls else None,
+                "image_count": len(urls),
+                "active_booking_count": bookings.get(row.id, 0),
+            }
+        )
+    if rows:
+        db.execute(update(Item), rows)
+
+
+# Подписчики на изменение каталога (снимок, поисковые индексы). Одиночные правки вызывают
+# notify_catalog_changed после коммита, массовый импорт — один раз в конце. Уведомление доходит
+# и до остальных воркеров через версию в cache_version (app/invalidation.py).
+CATALOG_CACHE = "catalog"
+
+
+def on_catalog_change(callback: Callable[[], None]) -> Callable[[], None]:
+    return on_invalidate(CATALOG_CACHE, callback)
+
+
+def notify_catalog_changed() -> None:
+    publish(CATALOG_CACHE)
@@ -0,0 +1,196 @@
+# Массовый импорт/обновление товаров из CSV, JSON Lines или JSON.
+# Запуск из консоли: python -m app.catalog_import items.csv
+import csv
+import io
+import json
+import re
+import sys
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .catalog import clean_item_data, notify_catalog_changed, sync_item_images
+from .database import SessionLocal
+from .models import Category, Item
+
+IMPORT_BATCH = 200
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors: List[Tuple[int, str]] = []
+
+    def error(self, row_no: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_no, message))
+
+
+def read_rows(stream: BinaryIO, filename: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    # (номер строки, данные, ошибка разбора). CSV и JSON Lines читаются потоково,
+    # обычный JSON-массив разбирается целиком.
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    lower = filename.lower()
+    if lower.endswith(".csv"):
+        for row_no, row in enumerate(csv.DictReader(text), 2):
+            yield row_no, row, None
+    elif lower.endswith((".jsonl", ".ndjson")):
+        for row_no, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield row_no, None, f"Некорректный JSON: {exc}"
+                continue
+            yield (row_no, row, None) if isinstance(row, dict) else (row_no, None, "Ожидался объект.")
+    elif lower.endswith(".json"):
+        try:
+            data = json.load(text)
+        except ValueError as exc:
+            yield 0, None, f"Некорректный JSON: {exc}"
+            return
+        if not isinstance(data, list):
+            yield 0, None, "Ожидался массив объектов."
+            return
+        for row_no, row in enumerate(data, 1):
+            yield (row_no, row, None) if isinstance(row, dict) else (row_no, None, "Ожидался объект.")
+    else:
+        yield 0, None, "Поддерживаются файлы .csv, .jsonl, .ndjson и .json."
+
+
+def parse_image_urls(raw) -> List[str]:
+    if isinstance(raw, list):
+        return [str(url).strip() for url in raw if str(url).strip()]
+    return [url for url in re.split(r"[\s|]+", str(raw or "")) if url]
+
+
+def import_items(
+    db: Session, rows: Iterator[Tuple[int, Optional[dict], Optional[str]]], batch_size: int = IMPORT_BATCH
+) -> ImportReport:
+    # Строка без id ищется по точному названию; найденный товар обновляется, иначе создаётся.
+    # Картинки заменяются только если в строке заполнено поле images.
+    report = ImportReport()
+    categories = dict(db.query(Category.name, Category.id).all())
+    category_ids = set(categories.values())
+    known_ids = {item_id for (item_id,) in db.query(Item.id)}
+    by_name: Dict[str, Union[int, Item]] = {name: item_id for item_id, name in db.query(Item.id, Item.name)}
+    batch_rows: List[int] = []
+    # новые товары пакета: название -> (объект, картинки); id появятся после flush
+    pending: Dict[str, Tuple[Item, List[str]]] = {}
+    counts = {"created": 0, "updated": 0}
+
+    def reset_batch() -> None:
+        # объекты записанного пакета больше не нужны — память не растёт с размером файла
+        db.expunge_all()
+        batch_rows.clear()
+        pending.clear()
+        counts.update(created=0, updated=0)
+
+    def fail_batch(exc: Exception) -> None:
+        db.rollback()
+        for row_no in batch_rows:
+            report.error(row_no, f"Ошибка записи пакета: {getattr(exc, 'orig', exc)}")
+        for name in pending:
+            del by_name[name]
+        reset_batch()
+
+    def flush_batch() -> None:
+        try:
+            db.flush()
+            for item, urls in pending.values():
+                sync_item_images(db, item.id, urls)
+            db.commit()
+        except SQLAlchemyError as exc:
+            fail_batch(exc)
+            return
+        report.created += counts["created"]
+        report.updated += counts["updated"]
+        for name, (item, _) in pending.items():
+            by_name[name] = item.id
+            known_ids.add(item.id)
+        reset_batch()
+
+    for row_no, row, parse_error in rows:
+        if parse_error:
+            report.error(row_no, parse_error)
+            continue
+        data = dict(row)
+        if not data.get("category_id") and data.get("category"):
+            data["category_id"] = categories.get(str(data["category"]).strip(), -1)
+        values, error = clean_item_data(data, category_ids)
+        if error:
+            report.error(row_no, error)
+            continue
+        # пустая ячейка CSV оставляет картинки как есть, пустой список в JSON — удаляет
+        urls = parse_image_urls(data["images"]) if data.get("images") not in (None, "") else None
+
+        raw_id = str(data.get("id") or "").strip()
+        target: Optional[Union[int, Item]]
+        if raw_id:
+            target = int(raw_id) if raw_id.isdigit() else None
+            if target not in known_ids:
+                report.error(row_no, f"Товар с id {raw_id} не найден.")
+                continue
+        else:
+            target = by_name.get(values["name"])
+
+        if isinstance(target, Item):
+            # повтор названия внутри пакета — правим ещё не записанный объект
+            for field, value in values.items():
+                setattr(target, field, value)
+            if urls is not None:
+                pending[values["name"]] = (target, urls)
+            counts["updated"] += 1
+        elif target is not None:
+            try:
+                db.query(Item).filter(Item.id == target).update(values, synchronize_session=False)
+                if urls is not None:
+                    sync_item_images(db, target, urls)
+            except SQLAlchemyError as exc:
+                # транзакция пакета уже испорчена — откатываем весь пакет вместе с этой строкой
+                batch_rows.append(row_no)
+                fail_batch(exc)
+                continue
+            counts["updated"] += 1
+        else:
+            item = Item(**values)
+            db.add(item)
+            pending[values["name"]] = (item, urls or [])
+            by_name[values["name"]] = item
+            counts["created"] += 1
+        batch_rows.append(row_no)
+        if len(batch_rows) >= batch_size:
+            flush_batch()
+
+    flush_batch()
+    if report.created or report.updated:
+        notify_catalog_changed()
+    return report
+
+
+def import_file(stream: BinaryIO, filename: str, batch_size: int = IMPORT_BATCH) -> ImportReport:
+    with SessionLocal() as db:
+        return import_items(db, read_rows(stream, filename), batch_size)
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) != 1:
+        print("Использование: python -m app.catalog_import <файл.csv|.jsonl|.json>")
+        return 2
+    path = argv[0]
+    with open(path, "rb") as stream:
+        report = import_file(stream, path)
+    print(f"создано: {report.created}, обновлено: {report.updated}, ошибок: {report.failed}")
+    for row_no, message in report.errors:
+        print(f"  строка {row_no}: {message}")
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,46 @@
+import secrets
+from contextvars import ContextVar
+from typing import Optional
+
+
+def _incoming_request_id(scope) -> str:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-request-id":
+            return value.decode("latin-1")[:64]
+    return ""
+
+
+class RequestContext:
+    __slots__ = ("scope", "method", "request_id", "sql_count", "sql_trace")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope.get("method", "")
+        self.request_id = _incoming_request_id(scope) or secrets.token_hex(8)
+        self.sql_count = 0
+        self.sql_trace = None
+
+    @property
+    def user_id(self) -> Optional[int]:
+        session = self.scope.get("session")
+        return session.get("user_id") if session else None
+
+    @property
+    def route(self) -> str:
+        # роутер дописывает "route" в тот же scope, поэтому шаблон доступен и внутри обработчика
+        return route_label(self.scope)
+
+
+request_context: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+
+def current_context() -> Optional[RequestContext]:
+    return request_context.get()
+
+
+def route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mount (например, /static) выставляет root_path вместо route
+    return scope.get("root_path") or "<unmatched>"
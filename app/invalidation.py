@@ -0,0 +1,94 @@
+# Сброс кешей в памяти во всех воркерах без внешнего брокера. У каждого кеша есть имя и версия
+# в таблице cache_version: воркер, изменивший данные, увеличивает версию и сразу обновляет свой
+# кеш, остальные раз в CACHE_POLL_SECONDS читают таблицу (несколько строк по первичному ключу)
+# и вызывают подписчиков для имён, версия которых изменилась.
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, List
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from .database import SessionLocal
+from .models import CacheVersion
+
+logger = logging.getLogger(__name__)
+
+_handlers: Dict[str, List[Callable[[], None]]] = {}
+# последняя версия каждого кеша, которую этот воркер уже применил
+_seen: Dict[str, int] = {}
+_seen_lock = threading.Lock()
+
+
+def on_invalidate(name: str, callback: Callable[[], None]) -> Callable[[], None]:
+    _handlers.setdefault(name, []).append(callback)
+    return callback
+
+
+def run_handlers(name: str) -> None:
+    for callback in list(_handlers.get(name, ())):
+        try:
+            callback()
+        except Exception:
+            logger.exception("cache invalidation handler failed: %s", getattr(callback, "__name__", callback))
+
+
+def bump_version(name: str) -> int:
+    # Отдельная короткая транзакция после коммита самих данных: другой воркер, увидевший новую
+    # версию, перечитает уже изменённые строки
+    with SessionLocal() as db:
+        for _ in range(2):
+            result = db.execute(
+                update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+            )
+            if result.rowcount:
+                break
+            try:
+                db.execute(insert(CacheVersion).values(name=name, version=1))
+                break
+            except IntegrityError:
+                # строку только что вставил другой воркер — повторяем UPDATE
+                db.rollback()
+        version = db.query(CacheVersion.version).filter(CacheVersion.name == name).scalar()
+        db.commit()
+    return version
+
+
+def publish(name: str) -> None:
+    # Данные уже закоммичены: поднимаем версию для остальных воркеров и обновляем свой кеш.
+    # Свой кеш обновляется после записи версии, поэтому включает и чужие изменения до неё.
+    try:
+        version = bump_version(name)
+    except Exception:
+        logger.exception("cache version bump failed: %s", name)
+    else:
+        with _seen_lock:
+            _seen[name] = max(version, _seen.get(name, 0))
+    run_handlers(name)
+
+
+def poll(fire: bool = True) -> List[str]:
+    # Возвращает имена кешей, изменённых другими воркерами. fire=False только запоминает версии
+    # (при старте, до первой загрузки кешей).
+    with SessionLocal() as db:
+        versions = dict(db.query(CacheVersion.name, CacheVersion.version).all())
+    with _seen_lock:
+        changed = [name for name, version in versions.items() if _seen.get(name, 0) < version]
+        for name in changed:
+            _seen[name] = versions[name]
+    if fire:
+        for name in changed:
+            run_handlers(name)
+    return changed
+
+
+async def invalidation_poller(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            changed = await asyncio.to_thread(poll)
+            if changed:
+                logger.info("caches invalidated: %s", ", ".join(changed), extra={"caches": changed})
+        except Exception:
+            logger.exception("cache invalidation poll failed")
@@ -0,0 +1,165 @@
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+from typing import List, Optional
+
+from .context import current_context
+
+access_logger = logging.getLogger("app.access")
+
+# Атрибуты LogRecord, которые не считаются пользовательскими полями (extra)
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = current_context()
+        if ctx is not None:
+            record.request_id = ctx.request_id
+            record.route = ctx.route
+            user_id = ctx.user_id
+            if user_id is not None:
+                record.user_id = user_id
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # форматирование сообщения и трейсбека — в потоке запроса, JSON — в потоке слушателя
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def build_sinks(spec: str) -> List[logging.Handler]:
+    handlers: List[logging.Handler] = []
+    for raw in spec.split(","):
+        sink = raw.strip()
+        if not sink:
+            continue
+        if sink == "stdout":
+            handlers.append(logging.StreamHandler(sys.stdout))
+        elif sink == "stderr":
+            handlers.append(logging.StreamHandler(sys.stderr))
+        elif sink.startswith("file:"):
+            # WatchedFileHandler переоткрывает файл после logrotate
+            handlers.append(WatchedFileHandler(sink[len("file:"):], encoding="utf-8"))
+        else:
+            raise ValueError(f"Неизвестный приёмник логов: {sink}")
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+_listener: Optional[QueueListener] = None
+
+
+def start_logging(level: str, sinks: str, queue_size: int) -> None:
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    app_logger = logging.getLogger("app")
+    app_logger.handlers = [handler]
+    app_logger.setLevel(level.upper())
+    app_logger.propagate = False
+    _listener = QueueListener(log_queue, *build_sinks(sinks), respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    logging.getLogger("app").handlers = []
+
+
+class AccessLogMiddleware:
+    def __init__(self, app, sample_rate: float, slow_ms: float):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        ctx = current_context()
+        if scope["type"] != "http" or ctx is None:
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+        response_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", ctx.request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            # ошибки и медленные запросы пишутся всегда, остальное — с вероятностью sample_rate
+            if status_code >= 500 or duration_ms >= self.slow_ms or random.random() < self.sample_rate:
+                access_logger.info(
+                    "%s %s %s",
+                    scope["method"],
+                    scope["path"],
+                    status_code,
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 2),
+                        "bytes": response_size,
+                        "sql": ctx.sql_count,
+                    },
+                )
@@ -1,29 +1,137 @@
-from fastapi import FastAPI
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 
-from .config import BASE_DIR, SESSION_COOKIE_SAMESITE, SESSION_COOKIE_SECURE, SESSION_SECRET
-from .seed import init_db
-from .routes import admin, auth, cart, public
-
-app = FastAPI()
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=SESSION_SECRET,
-    https_only=SESSION_COOKIE_SECURE,
-    same_site=SESSION_COOKIE_SAMESITE,
+from .config import (
+    ACCESS_LOG_SAMPLE,
+    ACCESS_LOG_SLOW_MS,
+    BASE_DIR,
+    CACHE_POLL_SECONDS,
+    HOLD_SWEEP_SECONDS,
+    INIT_DB_ON_STARTUP,
+    LOG_LEVEL,
+    LOG_QUEUE_SIZE,
+    LOG_SINKS,
+    METRICS_TOKEN,
+    PROFILE_DIR,
+    PROFILE_INTERVAL_MS,
+    PROFILER_ENABLED,
+    SESSION_COOKIE_SAMESITE,
+    SESSION_COOKIE_SECURE,
+    SESSION_SECRET,
+    SQL_N_PLUS_ONE,
+    SQL_SLOW_MS,
+    ORDER_ARCHIVE_SECONDS,
+    SQL_TRACE,
+    UPLOAD_GC_SECONDS,
 )
-app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+from .archive import order_archiver
+from .booking import hold_sweeper
+from .database import engine
+from .invalidation import invalidation_poller, poll
+from .logs import AccessLogMiddleware, start_logging, stop_logging
+from .metrics import MetricsMiddleware, install_sql_metrics, render_metrics
+from .passwords import start_password_pool, stop_password_pool
+from .profiler import ProfilerMiddleware
+from .routes import admin, api, auth, cart, media, public
+from .snapshot import reload_snapshot
+from .sqltrace import SqlTraceMiddleware, install_sql_tracing
+from .uploads import upload_gc
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # пул хеширования форкается первым, пока в процессе нет фоновых потоков
+    start_password_pool()
+    start_logging(LOG_LEVEL, LOG_SINKS, LOG_QUEUE_SIZE)
+    if INIT_DB_ON_STARTUP:
+        from .seed import init_db
+
+        init_db()
+    try:
+        # версии кешей запоминаются до загрузки снимка: правка между ними будет замечена опросом
+        poll(fire=False)
+        # снимок каталога готов до первого запроса; при ошибке соберётся при первом обращении
+        reload_snapshot()
+    except Exception:
+        logger.exception("catalog snapshot load failed")
+    app.state.startup_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        "startup: import %.1f ms, lifespan %.1f ms",
+        app.state.import_ms,
+        app.state.startup_ms,
+    )
+    background = [
+        asyncio.create_task(hold_sweeper(HOLD_SWEEP_SECONDS)),
+        asyncio.create_task(upload_gc(UPLOAD_GC_SECONDS)),
+        asyncio.create_task(order_archiver(ORDER_ARCHIVE_SECONDS)),
+        asyncio.create_task(invalidation_poller(CACHE_POLL_SECONDS)),
+    ]
+    yield
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    stop_password_pool()
+    stop_logging()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    if PROFILER_ENABLED:
+        # внутри SessionMiddleware: для проверки прав нужна сессия
+        app.add_middleware(
+            ProfilerMiddleware,
+            profile_dir=PROFILE_DIR,
+            interval_ms=PROFILE_INTERVAL_MS,
+            base_dir=BASE_DIR,
+        )
+    app.add_middleware(
+        SessionMiddleware,
+        secret_key=SESSION_SECRET,
+        https_only=SESSION_COOKIE_SECURE,
+        same_site=SESSION_COOKIE_SAMESITE,
+    )
+    if SQL_TRACE:
+        app.add_middleware(SqlTraceMiddleware)
+        install_sql_tracing(engine, slow_ms=SQL_SLOW_MS, n_plus_one=SQL_N_PLUS_ONE)
+    app.add_middleware(AccessLogMiddleware, sample_rate=ACCESS_LOG_SAMPLE, slow_ms=ACCESS_LOG_SLOW_MS)
+    # MetricsMiddleware — внешний слой: он создаёт контекст запроса для остальных
+    app.add_middleware(MetricsMiddleware)
+    install_sql_metrics(engine)
+    # загрузки отдаются своим маршрутом (X-Accel-Redirect/pathsend), он должен идти раньше /static
+    app.include_router(media.router)
+    app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+
+    app.include_router(public.router)
+    app.include_router(auth.router)
+    app.include_router(cart.router)
+    app.include_router(admin.router)
+    app.include_router(api.router)
 
-app.include_router(public.router)
-app.include_router(auth.router)
-app.include_router(cart.router)
-app.include_router(admin.router)
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
 
+    @app.get("/metrics", include_in_schema=False)
+    def metrics(request: Request):
+        if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+            return PlainTextResponse("forbidden\n", status_code=403)
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
-@app.get("/health")
-def health():
-    return {"status": "ok"}
+    return app
 
 
-init_db()
+app = create_app()
+app.state.import_ms = (time.perf_counter() - _IMPORT_STARTED) * 1000
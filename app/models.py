@@ -1,7 +1,8 @@
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, SmallInteger, String, Text
 from sqlalchemy.orm import relationship
 
 from .database import Base
+from .statuses import OrderStatus, order_status_label, payment_status_name
 
 
 class User(Base):
@@ -13,8 +14,8 @@ class User(Base):
     password_hash = Column(String(255), nullable=False)
     role = Column(String(50), nullable=False, default="user")
     email_confirmed = Column(Boolean, nullable=False, default=False)
-    confirmation_token = Column(String(255), nullable=True)
-    reset_token = Column(String(255), nullable=True)
+    confirmation_token = Column(String(255), nullable=True, index=True)
+    reset_token = Column(String(255), nullable=True, index=True)
     reset_token_expires_at = Column(DateTime, nullable=True)
 
     orders = relationship("Order", backref="user", lazy="joined")
@@ -22,7 +23,10 @@ class User(Base):
     def set_password(self, password: str) -> None:
         from werkzeug.security import generate_password_hash
 
-        self.password_hash = generate_password_hash(password)
+        from .config import PASSWORD_HASH_METHOD
+
+        # синхронный вариант для скриптов (seed); в обработчиках запросов — app.passwords
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
 
     def check_password(self, password: str) -> bool:
         from werkzeug.security import check_password_hash
@@ -50,31 +54,130 @@ class Item(Base):
     price_per_week = Column(Integer, nullable=False, default=0)
     short_description = Column(Text, nullable=False)
     description = Column(Text, nullable=False)
-
-    category_id = Column(Integer, ForeignKey("category.id"), nullable=False)
-    images = relationship("ItemImage", backref="item", lazy="joined")
+    # сколько единиц товара можно выдать одновременно
+    stock = Column(Integer, nullable=False, default=1)
+    # поля карточки каталога, пересчитываются при записи (app/catalog.py, app/booking.py):
+    # список товаров читается одним узким запросом без картинок и заказов
+    min_price = Column(Integer, nullable=True)
+    cover_image_url = Column(String(500), nullable=True)
+    image_count = Column(Integer, nullable=False, default=0)
+    active_booking_count = Column(Integer, nullable=False, default=0)
+    search_text = Column(Text, nullable=False, default="")
+
+    category_id = Column(Integer, ForeignKey("category.id"), nullable=False, index=True)
+    images = relationship("ItemImage", backref="item", lazy="joined", order_by="ItemImage.position")
     orders = relationship("Order", backref="item", lazy="joined")
 
+    __table_args__ = (
+        # каталог: фильтр по категории и сортировка/фильтр по цене
+        Index("ix_item_category_price", "category_id", "min_price"),
+        Index("ix_item_min_price", "min_price"),
+        Index("ix_item_price_per_hour", "price_per_hour"),
+        Index("ix_item_price_per_day", "price_per_day"),
+        Index("ix_item_price_per_week", "price_per_week"),
+    )
+
 
 class ItemImage(Base):
     __tablename__ = "item_image"
 
     id = Column(Integer, primary_key=True)
     url = Column(String(500), nullable=False)
-    item_id = Column(Integer, ForeignKey("item.id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("item.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False, default=0)
 
 
-class Order(Base):
-    __tablename__ = "order"
+class UploadRef(Base):
+    # сколько картинок ссылается на загруженный файл; файлы без ссылок удаляет фоновая задача
+    __tablename__ = "upload_ref"
 
-    id = Column(Integer, primary_key=True)
+    url = Column(String(500), primary_key=True)
+    refcount = Column(Integer, nullable=False, default=0)
+
+
+class OrderFields:
+    # колонки и свойства, общие для действующих заказов и архива
     date_from = Column(String(10), nullable=False)
     date_to = Column(String(10), nullable=False)
-    status = Column(String(80), nullable=False, default="в обработке")
+    status_code = Column(SmallInteger, nullable=False, default=OrderStatus.PROCESSING)
     start_at = Column(String(19), nullable=True)
     end_at = Column(String(19), nullable=True)
-    payment_id = Column(String(120), nullable=True)
-    payment_status = Column(String(50), nullable=True)
+    payment_id = Column(String(120), nullable=True, index=True)
+    payment_code = Column(SmallInteger, nullable=True)
+    # до какого момента неоплаченный заказ держит слот; NULL — бессрочно (оплачен или без онлайн-оплаты)
+    hold_expires_at = Column(DateTime, nullable=True)
+    qty = Column(Integer, nullable=False, default=1)
+    # сумма и часы аренды (на все единицы) по тарифам на момент бронирования: дневные итоги
+    # (app/analytics.py) не зависят от последующей смены цен
+    booked_amount = Column(Integer, nullable=True)
+    booked_hours = Column(Integer, nullable=True)
+
+    @property
+    def status(self) -> str:
+        return order_status_label(self.status_code)
+
+    @property
+    def payment_status(self):
+        return payment_status_name(self.payment_code)
+
+
+class Order(OrderFields, Base):
+    __tablename__ = "order"
 
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
     item_id = Column(Integer, ForeignKey("item.id"), nullable=False)
+
+    __table_args__ = (
+        # занятость товара и список броней: item_id + интервал, статусы — чтобы фильтр шёл по индексу
+        Index("ix_order_item_slot", "item_id", "start_at", "end_at", "status_code", "payment_code"),
+        # история заказов в профиле: user_id, ORDER BY id DESC
+        Index("ix_order_user_id", "user_id", "id"),
+        # поиск просроченных удержаний фоновой задачей
+        Index("ix_order_hold", "payment_code", "hold_expires_at"),
+        # id архивированных заказов не выдаются повторно (старые БД пересоздаёт seed.ensure_order_autoincrement)
+        {"sqlite_autoincrement": True},
+    )
+
+
+class OrderArchive(OrderFields, Base):
+    # Завершённые заказы, перенесённые из order (app/archive.py). Товар и пользователь могли быть
+    # удалены, поэтому внешних ключей нет, а название товара сохраняется на момент архивации.
+    __tablename__ = "order_archive"
+
+    archive_id = Column(Integer, primary_key=True)
+    id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    item_id = Column(Integer, nullable=False)
+    item_name = Column(String(255), nullable=True)
+    archived_at = Column(DateTime, nullable=False)
+
+    item = relationship("Item", primaryjoin="foreign(OrderArchive.item_id) == Item.id", viewonly=True, lazy="joined")
+
+    __table_args__ = (
+        Index("ix_order_archive_user_id", "user_id", "id"),
+        Index("ix_order_archive_id", "id"),
+    )
+
+
+class ItemDailyStats(Base):
+    # Дневные итоги по товару и статусу заказа (app/analytics.py): заказы попадают в день начала аренды.
+    # Дашборд читает только эту таблицу, без сканирования заказов.
+    __tablename__ = "item_daily_stats"
+
+    day = Column(String(10), primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    status_code = Column(SmallInteger, primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    booked_hours = Column(Integer, nullable=False, default=0)
+    revenue = Column(Integer, nullable=False, default=0)
+
+
+class CacheVersion(Base):
+    # Версии кешей в памяти воркеров (app/invalidation.py): запись увеличивает версию, остальные
+    # воркеры периодически сверяют её со своей и сбрасывают устаревший кеш.
+    __tablename__ = "cache_version"
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,100 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from .config import PASSWORD_HASH_METHOD, PASSWORD_QUEUE_LIMIT, PASSWORD_WORKERS
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def hash_method_prefix(method: str) -> str:
+    # werkzeug дописывает параметры по умолчанию: "scrypt" -> "scrypt:32768:8:1"
+    from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+    parts = method.split(":")
+    if parts[0] == "scrypt" and len(parts) == 1:
+        return "scrypt:32768:8:1"
+    if parts[0] == "pbkdf2":
+        if len(parts) == 1:
+            parts.append("sha256")
+        if len(parts) == 2:
+            parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ":".join(parts)
+
+
+def needs_rehash(password_hash: str, method: str = PASSWORD_HASH_METHOD) -> bool:
+    return password_hash.split("$", 1)[0] != hash_method_prefix(method)
+
+
+# Функции ниже выполняются в процессах пула, поэтому определены на уровне модуля
+def _hash(password: str, method: str) -> str:
+    from werkzeug.security import generate_password_hash
+
+    return generate_password_hash(password, method=method)
+
+
+def _verify(password_hash: str, password: str, method: str) -> Tuple[bool, Optional[str]]:
+    from werkzeug.security import check_password_hash, generate_password_hash
+
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if needs_rehash(password_hash, method):
+        # пароль верный, но параметры устарели — новый хеш считается тут же, без второго захода в пул
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+def _noop() -> None:
+    return None
+
+
+_executor: Optional[Executor] = None
+_pending = 0
+
+
+def start_password_pool() -> None:
+    # Процессы создаются fork'ом при первой задаче, поэтому пул прогревается в lifespan
+    # до запуска фоновых потоков (логирование, метрики)
+    global _executor
+    if _executor is not None or PASSWORD_WORKERS <= 0:
+        return
+    _executor = ProcessPoolExecutor(
+        max_workers=PASSWORD_WORKERS,
+        mp_context=multiprocessing.get_context("fork"),
+    )
+    _executor.submit(_noop).result()
+
+
+def stop_password_pool() -> None:
+    global _executor
+    if _executor is None:
+        return
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+async def _run(func, *args):
+    # Ограничение очереди: при шторме логинов лишние запросы сразу получают отказ,
+    # а не копятся и не отнимают процессор у остального трафика
+    global _pending
+    if _pending >= PASSWORD_QUEUE_LIMIT:
+        raise PasswordHasherBusy()
+    _pending += 1
+    try:
+        if _executor is None:
+            return await asyncio.to_thread(func, *args)
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password, PASSWORD_HASH_METHOD)
+
+
+async def verify_password(password_hash: str, password: str) -> Tuple[bool, Optional[str]]:
+    # (пароль верный, новый хеш или None, если пересчитывать не нужно)
+    return await _run(_verify, password_hash, password, PASSWORD_HASH_METHOD)
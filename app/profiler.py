@@ -0,0 +1,132 @@
+import os
+import re
+import secrets
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from .context import route_label
+
+PROFILE_FILE_RE = re.compile(r"^[0-9A-Za-z_.-]+\.folded$")
+
+
+def _is_triggered(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-profile" and value not in (b"", b"0"):
+            return True
+    query = scope.get("query_string", b"")
+    if b"_profile" not in query:
+        # быстрый отказ без разбора строки запроса — так проходит почти каждый запрос
+        return False
+    values = parse_qs(query.decode("latin-1"), keep_blank_values=True).get("_profile")
+    return bool(values) and values[-1] != "0"
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float, base_dir: Path):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.base_dir = str(base_dir)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(self.base_dir):
+                filename = os.path.relpath(filename, self.base_dir)
+            else:
+                filename = os.path.basename(filename)
+            label = f"{code.co_qualname} ({filename}:{code.co_firstlineno})".replace(";", ",")
+            self._labels[code] = label
+        return label
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: List[str] = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+                self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def list_profiles(profile_dir: Path, limit: int = 50) -> List[dict]:
+    if not profile_dir.exists():
+        return []
+    files = sorted(profile_dir.glob("*.folded"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return [{"name": p.name, "size": p.stat().st_size} for p in files[:limit]]
+
+
+def resolve_profile(profile_dir: Path, name: str) -> Optional[Path]:
+    if not PROFILE_FILE_RE.match(name):
+        return None
+    path = profile_dir / name
+    return path if path.is_file() else None
+
+
+class ProfilerMiddleware:
+    def __init__(self, app, profile_dir: Path, interval_ms: float, base_dir: Path):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.interval = interval_ms / 1000
+        self.base_dir = base_dir
+
+    def _is_admin(self, scope) -> bool:
+        from starlette.requests import Request
+
+        from .database import SessionLocal
+        from .routes.admin import require_admin
+
+        with SessionLocal() as db:
+            return require_admin(Request(scope), db) is not None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _is_triggered(scope) or not self._is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = StackSampler(threading.get_ident(), self.interval, self.base_dir)
+        name_holder: Dict[str, str] = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # заголовок с именем файла выставляем заранее, сам профиль пишется после ответа
+                stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+                slug = re.sub(r"[^0-9A-Za-z]+", "_", route_label(scope)).strip("_") or "root"
+                name_holder["name"] = f"{stamp}-{slug}-{secrets.token_hex(3)}.folded"
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-file", name_holder["name"].encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            name = name_holder.get("name")
+            if name:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                (self.profile_dir / name).write_text(sampler.folded(), encoding="utf-8")
@@ -0,0 +1,111 @@
+# Проверка, что горячие запросы из app/routes идут по индексам (EXPLAIN QUERY PLAN).
+# Запуск: python -m app.query_plans — печатает планы и завершается с кодом 1,
+# если какой-то запрос полностью сканирует таблицу.
+import sys
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from .catalog import catalog_query
+from .database import SessionLocal, engine
+from .models import Category, Item, ItemDailyStats, ItemImage, Order, OrderArchive, User
+from .statuses import BOOKED_ORDER_STATUSES, OrderStatus, PaymentStatus
+
+HOT_QUERIES: Dict[str, Callable[[Session], object]] = {
+    "get_current_user": lambda db: db.query(User).filter(User.id == 1),
+    "login/register: user by email": lambda db: db.query(User).filter(User.email == "user@example.com"),
+    "confirm_email: user by token": lambda db: db.query(User).filter(User.confirmation_token == "token"),
+    "reset_password: user by token": lambda db: db.query(User).filter(User.reset_token == "token"),
+    "profile: user orders": lambda db: db.query(Order).filter(Order.user_id == 1),
+    "profile: archived orders": lambda db: db.query(OrderArchive).filter(OrderArchive.user_id == 1),
+    "catalog: items by category": lambda db: db.query(Item.id, Item.name, Item.min_price).filter(
+        Item.category_id == 1
+    ),
+    "catalog: by price, keyset": lambda db: catalog_query(db, sort="price_asc", after="100.5").limit(25),
+    "catalog: category by price": lambda db: catalog_query(
+        db, category_id=1, sort="price_desc", min_price=100
+    ).limit(25),
+    "catalog: day tariff by price": lambda db: catalog_query(db, tariff="day", sort="price_asc").limit(25),
+    "item_detail: item": lambda db: db.query(Item).filter(Item.id == 1),
+    "item_detail: bookings": lambda db: (
+        db.query(Order)
+        .filter(
+            Order.item_id == 1,
+            Order.start_at.isnot(None),
+            Order.end_at.isnot(None),
+            Order.status_code.in_(BOOKED_ORDER_STATUSES),
+        )
+        .order_by(Order.start_at)
+    ),
+    "availability: active orders": lambda db: db.query(Order.start_at, Order.end_at, Order.qty).filter(
+        Order.item_id == 1,
+        Order.start_at.isnot(None),
+        Order.end_at.isnot(None),
+        Order.start_at < "2030-01-02",
+        Order.end_at >= "2030-01-01",
+        or_(Order.payment_code.is_(None), Order.payment_code != PaymentStatus.CANCELED),
+        or_(Order.hold_expires_at.is_(None), Order.hold_expires_at > datetime(2030, 1, 1)),
+    ),
+    "hold sweeper: stale holds": lambda db: db.query(Order.id).filter(
+        Order.payment_code == PaymentStatus.PENDING,
+        Order.hold_expires_at < datetime(2030, 1, 1),
+        Order.status_code == OrderStatus.AWAITING_PAYMENT,
+    ),
+    "payment_return: orders by ids": lambda db: db.query(Order).filter(Order.id.in_([1, 2])),
+    "payment_return: orders by payment_id": lambda db: db.query(Order).filter(Order.payment_id == "payment"),
+    "admin: category by name": lambda db: db.query(Category).filter(Category.name == "name"),
+    "admin: item images": lambda db: db.query(ItemImage).filter(ItemImage.item_id == 1),
+    "admin: analytics rollups": lambda db: db.query(ItemDailyStats).filter(
+        ItemDailyStats.day >= "2030-01-01", ItemDailyStats.day <= "2030-01-31"
+    ),
+}
+
+
+def explain(db: Session, query) -> List[str]:
+    statement = query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    rows = db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    bad = []
+    for detail in plan:
+        if not detail.startswith("SCAN "):
+            continue
+        if "USING INDEX" in detail or "USING COVERING INDEX" in detail or "USING INTEGER PRIMARY KEY" in detail:
+            continue
+        # сканирование подзапроса (CO-ROUTINE/MATERIALIZE) таблицу не читает
+        target = detail.split()[1]
+        if target.startswith("anon_"):
+            continue
+        bad.append(detail)
+    return bad
+
+
+def check_query_plans(db: Session) -> List[Tuple[str, List[str], List[str]]]:
+    results = []
+    for name, build in HOT_QUERIES.items():
+        plan = explain(db, build(db))
+        results.append((name, plan, full_scans(plan)))
+    return results
+
+
+def main() -> int:
+    if engine.dialect.name != "sqlite":
+        # формат EXPLAIN QUERY PLAN есть только у SQLite; в PostgreSQL планы смотрят через EXPLAIN
+        print(f"Проверка планов поддерживается только для SQLite, текущая БД: {engine.dialect.name}")
+        return 0
+    failed = 0
+    with SessionLocal() as db:
+        for name, plan, bad in check_query_plans(db):
+            print(f"{'FAIL' if bad else 'ok  '} {name}")
+            for detail in plan:
+                print(f"       {detail}")
+            failed += bool(bad)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from math import ceil
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .config import RATE_LIMIT_BACKEND, RATE_LIMIT_DB, RATE_LIMIT_ENABLED, RATE_LIMIT_MAX_KEYS
+from .metrics import rate_limit_rejections_total
+
+
+class Limit(NamedTuple):
+    # ведро на capacity попыток, полностью восстанавливается за period секунд
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+LIMITS: Dict[Tuple[str, str], Limit] = {
+    ("login", "ip"): Limit(30, 300),
+    ("login", "email"): Limit(10, 300),
+    ("register", "ip"): Limit(10, 3600),
+    ("forgot", "ip"): Limit(10, 900),
+    ("forgot", "email"): Limit(3, 3600),
+    ("resend", "ip"): Limit(10, 900),
+    ("resend", "email"): Limit(3, 3600),
+}
+
+
+def _refill(state: Optional[Tuple[float, float]], limit: Limit, now: float) -> Tuple[float, float]:
+    # (оставшиеся токены, через сколько секунд можно повторить; 0 — попытка разрешена)
+    if state is None:
+        tokens = float(limit.capacity)
+    else:
+        tokens = min(limit.capacity, state[0] + (now - state[1]) * limit.rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / limit.rate
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # ключ -> (токены, время обновления); самые давние ключи вытесняются первыми
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        with self._lock:
+            tokens, retry_after = _refill(self._buckets.pop(key, None), limit, now)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SqliteBuckets:
+    # Общее состояние для нескольких воркеров. Отдельный файл, чтобы не делить блокировку
+    # записи с бронированиями в основной БД.
+    def __init__(self, path: Path, max_age: float = 86400):
+        self.path = str(path)
+        self.max_age = max_age
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limit WHERE key = ?", (key,)).fetchone()
+            tokens, retry_after = _refill(row, limit, now)
+            conn.execute(
+                "INSERT INTO rate_limit (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            # изредка чистим ключи, которые давно не обновлялись (их ведра давно полные)
+            if random.random() < 0.001:
+                conn.execute("DELETE FROM rate_limit WHERE updated < ?", (now - self.max_age,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return retry_after
+
+
+_buckets = SqliteBuckets(RATE_LIMIT_DB) if RATE_LIMIT_BACKEND == "sqlite" else MemoryBuckets(RATE_LIMIT_MAX_KEYS)
+
+
+def client_ip(request) -> str:
+    # за reverse proxy адрес клиента подставляет uvicorn --proxy-headers
+    return request.client.host if request.client else "unknown"
+
+
+async def throttle(request, action: str, email: Optional[str] = None) -> int:
+    # Возвращает 0, если попытка разрешена, иначе через сколько секунд повторить.
+    # Без email проверяется IP — это не требует ни формы, ни БД, поэтому вызывается первым;
+    # с email — отдельное ведро на адрес (после разбора формы, до запросов в БД и хеширования).
+    if not RATE_LIMIT_ENABLED:
+        return 0
+    kind, value = ("email", email.strip().lower()) if email else ("ip", client_ip(request))
+    limit = LIMITS.get((action, kind))
+    if limit is None:
+        return 0
+    key = f"{action}:{kind}:{value}"
+    if isinstance(_buckets, MemoryBuckets):
+        retry_after = _buckets.take(key, limit, time.monotonic())
+    else:
+        # В общем SQLite-хранилище нужны часы, одинаковые для всех процессов. Запись с ожиданием
+        # блокировки файла (до 5 с) выполняется в пуле потоков, а не в цикле событий.
+        retry_after = await run_in_threadpool(_buckets.take, key, limit, time.time())
+    if not retry_after:
+        return 0
+    rate_limit_rejections_total.inc(action, kind)
+    return max(1, ceil(retry_after))
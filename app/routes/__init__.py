@@ -1,3 +1,3 @@
-from . import admin, auth, cart, public
+from . import admin, api, auth, cart, public
 
-__all__ = ["admin", "auth", "cart", "public"]
+__all__ = ["admin", "api", "auth", "cart", "public"]
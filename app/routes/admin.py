@@ -1,18 +1,29 @@
+from datetime import datetime
+
 from fastapi import APIRouter, Depends, Request
-from fastapi.responses import RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from .. import sqltrace
+from ..analytics import item_summary
+from ..archive import archive_orders
+from ..catalog import clean_item_data, notify_catalog_changed, sync_item_images
+from ..config import PROFILE_DIR, SQL_TRACE
 from ..database import get_db
+from ..exports import iter_order_rows, parse_status_filter, stream_csv, stream_ndjson
 from ..models import Category, Item, ItemImage, Order
+from ..profiler import list_profiles, resolve_profile
+from ..statuses import UNSETTLED_PAYMENT_CODES, OrderStatus
+from ..uploads import change_upload_refs, save_uploads
 from ..utils import (
     flash,
     get_cart,
     get_current_user,
     parse_form_data,
     parse_images,
-    parse_int_field,
     render,
-    save_uploads,
     ensure_csrf,
 )
 
@@ -54,42 +65,24 @@ async def admin_item_new(request: Request, db: Session = Depends(get_db)):
         form = parse_form_data(form_raw)
         if not ensure_csrf(request, form):
             return RedirectResponse(url=request.url_for("admin_item_new"), status_code=303)
-        name = form.get("name", "").strip()
-        price_per_hour = parse_int_field(form.get("price_per_hour", "0"))
-        price_per_3h = parse_int_field(form.get("price_per_3h", "0"))
-        price_per_day = parse_int_field(form.get("price_per_day", "0"))
-        price_per_week = parse_int_field(form.get("price_per_week", "0"))
-        short_description = form.get("short_description", "").strip()
-        description = form.get("description", "").strip()
-        category_id = form.get("category_id", "").strip()
+        values, error = clean_item_data(form, {c.id for c in categories})
         images_raw = form.get("images", "")
         image_files = form.get("image_files", [])
         if not isinstance(image_files, list):
             image_files = [image_files] if image_files else []
 
-        if not (name and short_description and description and category_id):
-            flash(request, "error", "Заполните все поля.")
-        elif not any([price_per_hour, price_per_3h, price_per_day, price_per_week]):
-            flash(request, "error", "Укажите хотя бы одну цену.")
+        if error:
+            flash(request, "error", error)
         else:
-            item = Item(
-                name=name,
-                price_per_hour=price_per_hour,
-                price_per_3h=price_per_3h,
-                price_per_day=price_per_day,
-                price_per_week=price_per_week,
-                short_description=short_description,
-                description=description,
-                category_id=int(category_id),
-            )
+            item = Item(**values)
             db.add(item)
             db.flush()
 
             urls = parse_images(images_raw) + save_uploads(image_files)
-            for url in urls:
-                db.add(ItemImage(url=url, item=item))
+            sync_item_images(db, item.id, urls)
 
             db.commit()
+            notify_catalog_changed()
             flash(request, "success", "Товар создан.")
             return RedirectResponse(url=request.url_for("admin_items"), status_code=303)
 
@@ -106,6 +99,37 @@ async def admin_item_new(request: Request, db: Session = Depends(get_db)):
     )
 
 
+@router.api_route("/admin/items/import", methods=["GET", "POST"])
+async def admin_items_import(request: Request, db: Session = Depends(get_db)):
+    admin = require_admin(request, db)
+    if not admin:
+        flash(request, "error", "Нужны права администратора.")
+        return RedirectResponse(url=request.url_for("login"), status_code=303)
+
+    report = None
+    if request.method == "POST":
+        form_raw = await request.form()
+        form = parse_form_data(form_raw)
+        if not ensure_csrf(request, form):
+            return RedirectResponse(url=request.url_for("admin_items_import"), status_code=303)
+        upload = form.get("file")
+        if isinstance(upload, list):
+            upload = upload[0] if upload else None
+        if not upload or not getattr(upload, "filename", None):
+            flash(request, "error", "Выберите файл.")
+            return RedirectResponse(url=request.url_for("admin_items_import"), status_code=303)
+        from ..catalog_import import import_file
+
+        # файл уже лежит во временном файле multipart-парсера, читаем его потоково вне event loop
+        report = await run_in_threadpool(import_file, upload.file, upload.filename)
+
+    return await render(
+        request,
+        "admin_import.html",
+        {"request": request, "current_user": admin, "report": report},
+    )
+
+
 @router.api_route("/admin/items/{item_id}/edit", methods=["GET", "POST"])
 async def admin_item_edit(request: Request, item_id: int, db: Session = Depends(get_db)):
     admin = require_admin(request, db)
@@ -125,39 +149,23 @@ async def admin_item_edit(request: Request, item_id: int, db: Session = Depends(
         form = parse_form_data(form_raw)
         if not ensure_csrf(request, form):
             return RedirectResponse(url=request.url_for("admin_item_edit", item_id=item_id), status_code=303)
-        name = form.get("name", "").strip()
-        price_per_hour = parse_int_field(form.get("price_per_hour", "0"))
-        price_per_3h = parse_int_field(form.get("price_per_3h", "0"))
-        price_per_day = parse_int_field(form.get("price_per_day", "0"))
-        price_per_week = parse_int_field(form.get("price_per_week", "0"))
-        short_description = form.get("short_description", "").strip()
-        description = form.get("description", "").strip()
-        category_id = form.get("category_id", "").strip()
+        values, error = clean_item_data(form, {c.id for c in categories})
         images_raw = form.get("images", "")
         image_files = form.get("image_files", [])
         if not isinstance(image_files, list):
             image_files = [image_files] if image_files else []
 
-        if not (name and short_description and description and category_id):
-            flash(request, "error", "Заполните все поля.")
-        elif not any([price_per_hour, price_per_3h, price_per_day, price_per_week]):
-            flash(request, "error", "Укажите хотя бы одну цену.")
+        if error:
+            flash(request, "error", error)
         else:
-            item.name = name
-            item.price_per_hour = price_per_hour
-            item.price_per_3h = price_per_3h
-            item.price_per_day = price_per_day
-            item.price_per_week = price_per_week
-            item.short_description = short_description
-            item.description = description
-            item.category_id = int(category_id)
-
-            db.query(ItemImage).filter(ItemImage.item_id == item.id).delete()
+            for field, value in values.items():
+                setattr(item, field, value)
+
             urls = parse_images(images_raw) + save_uploads(image_files)
-            for url in urls:
-                db.add(ItemImage(url=url, item=item))
+            sync_item_images(db, item.id, urls)
 
             db.commit()
+            notify_catalog_changed()
             flash(request, "success", "Товар обновлен.")
             return RedirectResponse(url=request.url_for("admin_items"), status_code=303)
 
@@ -189,10 +197,30 @@ async def admin_item_delete(request: Request, item_id: int, db: Session = Depend
     if not item:
         flash(request, "error", "Товар не найден.")
         return RedirectResponse(url=request.url_for("admin_items"), status_code=303)
+    # заказ, по которому ещё может прийти оплата, в архиве settle_payment уже не найдёт
+    unsettled = (
+        db.query(Order.id)
+        .filter(
+            Order.item_id == item.id,
+            or_(Order.payment_code.in_(UNSETTLED_PAYMENT_CODES), Order.status_code == OrderStatus.AWAITING_PAYMENT),
+        )
+        .count()
+    )
+    if unsettled:
+        flash(
+            request,
+            "error",
+            f"У товара есть заказы, ожидающие оплаты ({unsettled}). Удалите его после оплаты или отмены этих заказов.",
+        )
+        return RedirectResponse(url=request.url_for("admin_items"), status_code=303)
+    change_upload_refs(db, removed=[image.url for image in item.images])
     db.query(ItemImage).filter(ItemImage.item_id == item.id).delete()
-    db.query(Order).filter(Order.item_id == item.id).delete()
+    # заказы не удаляются, а уходят в архив вместе с названием товара
+    archive_orders(db, [row.id for row in db.query(Order.id).filter(Order.item_id == item.id)])
+    db.expire(item, ["orders"])
     db.delete(item)
     db.commit()
+    notify_catalog_changed()
     flash(request, "success", "Товар удален.")
     return RedirectResponse(url=request.url_for("admin_items"), status_code=303)
 
@@ -229,6 +257,7 @@ async def admin_category_new(request: Request, db: Session = Depends(get_db)):
     else:
         db.add(Category(name=name))
         db.commit()
+        notify_catalog_changed()
         flash(request, "success", "Категория добавлена.")
     return RedirectResponse(url=request.url_for("admin_categories"), status_code=303)
 
@@ -252,6 +281,7 @@ async def admin_category_edit(request: Request, category_id: int, db: Session =
     else:
         category.name = name
         db.commit()
+        notify_catalog_changed()
         flash(request, "success", "Категория обновлена.")
     return RedirectResponse(url=request.url_for("admin_categories"), status_code=303)
 
@@ -274,5 +304,87 @@ async def admin_category_delete(request: Request, category_id: int, db: Session
     else:
         db.delete(category)
         db.commit()
+        notify_catalog_changed()
         flash(request, "success", "Категория удалена.")
     return RedirectResponse(url=request.url_for("admin_categories"), status_code=303)
+
+
+@router.get("/admin/analytics")
+async def admin_analytics(request: Request, days: int = 30, db: Session = Depends(get_db)):
+    admin = require_admin(request, db)
+    if not admin:
+        flash(request, "error", "Нужны права администратора.")
+        return RedirectResponse(url=request.url_for("login"), status_code=303)
+    days = max(1, min(days, 366))
+    return await render(
+        request,
+        "admin_analytics.html",
+        {"request": request, "current_user": admin, "days": days, "summary": item_summary(db, days)},
+    )
+
+
+@router.get("/admin/diagnostics")
+async def admin_diagnostics(request: Request, db: Session = Depends(get_db)):
+    admin = require_admin(request, db)
+    if not admin:
+        flash(request, "error", "Нужны права администратора.")
+        return RedirectResponse(url=request.url_for("login"), status_code=303)
+    return await render(
+        request,
+        "admin_diagnostics.html",
+        {
+            "request": request,
+            "current_user": admin,
+            "sql_trace_enabled": SQL_TRACE,
+            "trace": sqltrace.snapshot(),
+            "profiles": list_profiles(PROFILE_DIR),
+        },
+    )
+
+
+@router.get("/admin/profiles/{name}")
+async def admin_profile_download(request: Request, name: str, db: Session = Depends(get_db)):
+    admin = require_admin(request, db)
+    if not admin:
+        flash(request, "error", "Нужны права администратора.")
+        return RedirectResponse(url=request.url_for("login"), status_code=303)
+    path = resolve_profile(PROFILE_DIR, name)
+    if not path:
+        flash(request, "error", "Профиль не найден.")
+        return RedirectResponse(url=request.url_for("admin_diagnostics"), status_code=303)
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=name)
+
+
+@router.get("/admin/orders/export")
+async def admin_orders_export(
+    request: Request,
+    format: str = "csv",
+    date_from: str = "",
+    date_to: str = "",
+    status: str = "",
+    db: Session = Depends(get_db),
+):
+    admin = require_admin(request, db)
+    if not admin:
+        flash(request, "error", "Нужны права администратора.")
+        return RedirectResponse(url=request.url_for("login"), status_code=303)
+    try:
+        statuses = parse_status_filter(status)
+        for value in (date_from, date_to):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        flash(request, "error", "Некорректный фильтр выгрузки: даты в формате ГГГГ-ММ-ДД, статусы — имена через запятую.")
+        return RedirectResponse(url=request.url_for("admin_items"), status_code=303)
+
+    rows = iter_order_rows(date_from, date_to, statuses)
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    if format == "ndjson":
+        body, media_type, filename = stream_ndjson(rows), "application/x-ndjson", f"orders-{stamp}.ndjson"
+    else:
+        body, media_type, filename = stream_csv(rows), "text/csv; charset=utf-8", f"orders-{stamp}.csv"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
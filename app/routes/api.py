@@ -0,0 +1,229 @@
+import base64
+import hashlib
+import json
+from typing import Callable, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import Response
+from sqlalchemy.orm import Session, noload, selectinload
+
+from ..config import PUBLIC_CACHE_SECONDS
+from ..database import get_db
+from ..models import Category, Item
+from ..utils import calculate_rental_price, check_item_availability, format_dt, parse_datetime_local
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него — стандартный json
+    orjson = None
+
+router = APIRouter(prefix="/api/v1")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+ITEM_FIELDS: Dict[str, Callable[[Item], object]] = {
+    "id": lambda item: item.id,
+    "name": lambda item: item.name,
+    "category_id": lambda item: item.category_id,
+    "short_description": lambda item: item.short_description,
+    "description": lambda item: item.description,
+    "prices": lambda item: {
+        "hour": item.price_per_hour,
+        "3h": item.price_per_3h,
+        "day": item.price_per_day,
+        "week": item.price_per_week,
+    },
+    "stock": lambda item: item.stock,
+    "images": lambda item: [image.url for image in item.images],
+}
+DEFAULT_ITEM_FIELDS = ("id", "name", "category_id", "short_description", "prices", "stock", "images")
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self.message = message
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(request: Request, payload, cache_seconds: int = 0, status_code: int = 200) -> Response:
+    body = dumps(payload)
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={cache_seconds}" if cache_seconds else "no-cache",
+    }
+    if status_code == 200 and etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def error_response(request: Request, error: ApiError) -> Response:
+    return json_response(request, {"error": error.message}, status_code=error.status_code)
+
+
+def parse_fields(raw: str) -> List[str]:
+    if not raw:
+        return list(DEFAULT_ITEM_FIELDS)
+    fields = [field.strip() for field in raw.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in ITEM_FIELDS]
+    if unknown:
+        raise ApiError(400, f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(ITEM_FIELDS)}.")
+    return fields
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    if not cursor:
+        return 0
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except ValueError:
+        raise ApiError(400, "Некорректный cursor.")
+
+
+def serialize_item(item: Item, fields: List[str]) -> dict:
+    return {field: ITEM_FIELDS[field](item) for field in fields}
+
+
+def items_query(db: Session, fields: List[str]):
+    # заказы товару в API не нужны, изображения — одним отдельным запросом на страницу
+    query = db.query(Item).options(noload(Item.orders))
+    if "images" in fields:
+        return query.options(selectinload(Item.images))
+    return query.options(noload(Item.images))
+
+
+def parse_period(start_at: str, end_at: str):
+    start_dt = parse_datetime_local(start_at)
+    end_dt = parse_datetime_local(end_at)
+    if not start_dt or not end_dt:
+        raise ApiError(400, "Укажите start_at и end_at в формате ГГГГ-ММ-ДД ЧЧ:ММ.")
+    if end_dt <= start_dt:
+        raise ApiError(400, "Окончание не может быть раньше или равно началу.")
+    return start_dt, end_dt
+
+
+def get_item_or_404(db: Session, item_id: int, fields: List[str]) -> Item:
+    item = items_query(db, fields).filter(Item.id == item_id).first()
+    if not item:
+        raise ApiError(404, "Товар не найден.")
+    return item
+
+
+@router.get("/categories")
+async def api_categories(request: Request, db: Session = Depends(get_db)):
+    rows = db.query(Category.id, Category.name).order_by(Category.name).all()
+    return json_response(
+        request,
+        {"data": [{"id": row.id, "name": row.name} for row in rows]},
+        cache_seconds=PUBLIC_CACHE_SECONDS,
+    )
+
+
+@router.get("/items")
+async def api_items(
+    request: Request,
+    category: Optional[int] = None,
+    cursor: str = "",
+    limit: int = DEFAULT_LIMIT,
+    fields: str = "",
+    db: Session = Depends(get_db),
+):
+    try:
+        selected = parse_fields(fields)
+        after_id = decode_cursor(cursor)
+    except ApiError as error:
+        return error_response(request, error)
+    limit = max(1, min(limit, MAX_LIMIT))
+    query = items_query(db, selected).filter(Item.id > after_id)
+    if category is not None:
+        query = query.filter(Item.category_id == category)
+    # одна лишняя строка показывает, есть ли следующая страница
+    items = query.order_by(Item.id).limit(limit + 1).all()
+    next_cursor = encode_cursor(items[limit - 1].id) if len(items) > limit else None
+    return json_response(
+        request,
+        {"data": [serialize_item(item, selected) for item in items[:limit]], "next_cursor": next_cursor},
+        cache_seconds=PUBLIC_CACHE_SECONDS,
+    )
+
+
+@router.get("/items/{item_id}")
+async def api_item(request: Request, item_id: int, fields: str = "", db: Session = Depends(get_db)):
+    try:
+        selected = parse_fields(fields)
+        item = get_item_or_404(db, item_id, selected)
+    except ApiError as error:
+        return error_response(request, error)
+    return json_response(request, {"data": serialize_item(item, selected)}, cache_seconds=PUBLIC_CACHE_SECONDS)
+
+
+@router.get("/items/{item_id}/availability")
+async def api_item_availability(
+    request: Request,
+    item_id: int,
+    start_at: str = "",
+    end_at: str = "",
+    qty: int = 1,
+    db: Session = Depends(get_db),
+):
+    try:
+        get_item_or_404(db, item_id, ["id"])
+        start_dt, end_dt = parse_period(start_at, end_at)
+    except ApiError as error:
+        return error_response(request, error)
+    conflict = check_item_availability(item_id, start_dt, end_dt, db, [], qty=max(1, qty))
+    return json_response(
+        request,
+        {
+            "data": {
+                "item_id": item_id,
+                "start_at": format_dt(start_dt),
+                "end_at": format_dt(end_dt),
+                "qty": max(1, qty),
+                "available": conflict is None,
+                "message": conflict,
+            }
+        },
+    )
+
+
+@router.get("/items/{item_id}/quote")
+async def api_item_quote(
+    request: Request,
+    item_id: int,
+    start_at: str = "",
+    end_at: str = "",
+    qty: int = 1,
+    db: Session = Depends(get_db),
+):
+    try:
+        item = get_item_or_404(db, item_id, ["prices"])
+        parse_period(start_at, end_at)
+    except ApiError as error:
+        return error_response(request, error)
+    total, start_dt, end_dt, tariff = calculate_rental_price(item, start_at, end_at, max(1, qty))
+    return json_response(
+        request,
+        {
+            "data": {
+                "item_id": item_id,
+                "start_at": format_dt(start_dt),
+                "end_at": format_dt(end_dt),
+                "qty": max(1, qty),
+                "total": total,
+                "tariff": tariff,
+            }
+        },
+        cache_seconds=PUBLIC_CACHE_SECONDS,
+    )
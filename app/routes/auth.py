@@ -5,7 +5,9 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from sqlalchemy.orm import Session
 
 from ..database import get_db
-from ..models import Item, Order, User
+from ..models import Item, Order, OrderArchive, User
+from ..passwords import PasswordHasherBusy, hash_password, verify_password
+from ..ratelimit import throttle
 from ..utils import (
     build_absolute_url,
     ensure_csrf,
@@ -16,11 +18,21 @@ from ..utils import (
     parse_form_data,
     render,
     render_confirmation_email,
+    rotate_session_id,
     send_email,
 )
 
 router = APIRouter()
 
+BUSY_MESSAGE = "Сервер перегружен, повторите попытку через минуту."
+
+
+def too_many_attempts(request: Request, url, retry_after: int) -> RedirectResponse:
+    flash(request, "error", f"Слишком много попыток. Повторите через {retry_after} с.")
+    response = RedirectResponse(url=url, status_code=303)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
 
 @router.api_route("/login", methods=["GET", "POST"], response_class=HTMLResponse)
 async def login(request: Request, db: Session = Depends(get_db)):
@@ -29,14 +41,31 @@ async def login(request: Request, db: Session = Depends(get_db)):
         return RedirectResponse(url=request.url_for("profile"), status_code=302)
 
     if request.method == "POST":
+        retry_after = await throttle(request, "login")
+        if retry_after:
+            return too_many_attempts(request, request.url_for("login"), retry_after)
         form_raw = await request.form()
         form = parse_form_data(form_raw)
         if not ensure_csrf(request, form):
             return RedirectResponse(url=request.url_for("login"), status_code=303)
         email = form.get("email", "").strip().lower()
         password = form.get("password", "")
+        retry_after = await throttle(request, "login", email=email)
+        if retry_after:
+            return too_many_attempts(request, request.url_for("login"), retry_after)
         found = db.query(User).filter(User.email == email).first()
-        if found and found.check_password(password):
+        valid = False
+        if found:
+            try:
+                valid, new_hash = await verify_password(found.password_hash, password)
+            except PasswordHasherBusy:
+                flash(request, "error", BUSY_MESSAGE)
+                return RedirectResponse(url=request.url_for("login"), status_code=303)
+            if valid and new_hash:
+                # хеш со старыми параметрами заменяется при успешном входе
+                found.password_hash = new_hash
+                db.commit()
+        if valid:
             if not found.email_confirmed:
                 if not found.confirmation_token:
                     found.confirmation_token = generate_token()
@@ -48,6 +77,7 @@ async def login(request: Request, db: Session = Depends(get_db)):
                 return RedirectResponse(url=request.url_for("login"), status_code=303)
 
             request.session["user_id"] = found.id
+            rotate_session_id(request)
             flash(request, "success", "Успешный вход.")
             next_url = request.query_params.get("next")
             return RedirectResponse(url=next_url or request.url_for("profile"), status_code=303)
@@ -64,6 +94,7 @@ async def login(request: Request, db: Session = Depends(get_db)):
 @router.get("/logout")
 async def logout(request: Request):
     request.session.pop("user_id", None)
+    request.session.pop("_sid", None)
     flash(request, "success", "Вы успешно вышли из аккаунта.")
     return RedirectResponse(url=request.url_for("index"), status_code=303)
 
@@ -75,6 +106,9 @@ async def register(request: Request, db: Session = Depends(get_db)):
         return RedirectResponse(url=request.url_for("profile"), status_code=302)
 
     if request.method == "POST":
+        retry_after = await throttle(request, "register")
+        if retry_after:
+            return too_many_attempts(request, request.url_for("register"), retry_after)
         form_raw = await request.form()
         form = parse_form_data(form_raw)
         if not ensure_csrf(request, form):
@@ -88,8 +122,12 @@ async def register(request: Request, db: Session = Depends(get_db)):
         elif db.query(User).filter(User.email == email).first():
             flash(request, "error", "Пользователь с таким email уже существует.")
         else:
-            new_user = User(full_name=name, email=email, role="user")
-            new_user.set_password(password)
+            try:
+                password_hash = await hash_password(password)
+            except PasswordHasherBusy:
+                flash(request, "error", BUSY_MESSAGE)
+                return RedirectResponse(url=request.url_for("register"), status_code=303)
+            new_user = User(full_name=name, email=email, role="user", password_hash=password_hash)
             new_user.confirmation_token = generate_token()
             db.add(new_user)
             db.commit()
@@ -130,11 +168,17 @@ async def confirm_email(request: Request, token: str, db: Session = Depends(get_
 @router.api_route("/forgot-password", methods=["GET", "POST"], response_class=HTMLResponse)
 async def forgot_password(request: Request, db: Session = Depends(get_db)):
     if request.method == "POST":
+        retry_after = await throttle(request, "forgot")
+        if retry_after:
+            return too_many_attempts(request, request.url_for("forgot_password"), retry_after)
         form_raw = await request.form()
         form = parse_form_data(form_raw)
         if not ensure_csrf(request, form):
             return RedirectResponse(url=request.url_for("forgot_password"), status_code=303)
         email = form.get("email", "").strip().lower()
+        retry_after = await throttle(request, "forgot", email=email)
+        if retry_after:
+            return too_many_attempts(request, request.url_for("forgot_password"), retry_after)
         user = db.query(User).filter(User.email == email).first()
         if user:
             user.reset_token = generate_token()
@@ -174,7 +218,11 @@ async def reset_password(request: Request, token: str, db: Session = Depends(get
         if not new_password:
             flash(request, "error", "Введите новый пароль.")
         else:
-            user.set_password(new_password)
+            try:
+                user.password_hash = await hash_password(new_password)
+            except PasswordHasherBusy:
+                flash(request, "error", BUSY_MESSAGE)
+                return RedirectResponse(url=request.url_for("reset_password", token=token), status_code=303)
             user.reset_token = None
             user.reset_token_expires_at = None
             db.commit()
@@ -194,7 +242,10 @@ async def profile(request: Request, db: Session = Depends(get_db)):
     if not user:
         flash(request, "error", "Нужно авторизоваться.")
         return RedirectResponse(url=request.url_for("login"), status_code=303)
-    orders = db.query(Order).filter(Order.user_id == user.id).order_by(Order.id.desc()).all()
+    orders = db.query(Order).filter(Order.user_id == user.id).all()
+    # история: действующие заказы вместе с архивными, новые сверху
+    orders += db.query(OrderArchive).filter(OrderArchive.user_id == user.id).all()
+    orders.sort(key=lambda order: order.id, reverse=True)
     cart_entries = []
     cart = get_cart(request)
     items_map = {item.id: item for item in db.query(Item).all()}
@@ -219,6 +270,9 @@ async def profile(request: Request, db: Session = Depends(get_db)):
 
 @router.post("/resend-confirmation")
 async def resend_confirmation(request: Request, db: Session = Depends(get_db)):
+    retry_after = await throttle(request, "resend")
+    if retry_after:
+        return too_many_attempts(request, request.url_for("profile"), retry_after)
     user = get_current_user(request, db)
     if not user:
         flash(request, "error", "Нужно авторизоваться.")
@@ -233,6 +287,10 @@ async def resend_confirmation(request: Request, db: Session = Depends(get_db)):
         flash(request, "success", "Email уже подтверждён.")
         return RedirectResponse(url=request.url_for("profile"), status_code=303)
 
+    retry_after = await throttle(request, "resend", email=user.email)
+    if retry_after:
+        return too_many_attempts(request, request.url_for("profile"), retry_after)
+
     if not user.confirmation_token:
         user.confirmation_token = generate_token()
         db.commit()
@@ -268,6 +326,11 @@ async def edit_profile(request: Request, db: Session = Depends(get_db)):
         elif email != user.email and db.query(User).filter(User.email == email).first():
             flash(request, "error", "Такой email уже занят.")
         else:
+            try:
+                password_hash = await hash_password(new_password) if new_password else None
+            except PasswordHasherBusy:
+                flash(request, "error", BUSY_MESSAGE)
+                return RedirectResponse(url=request.url_for("edit_profile"), status_code=303)
             user.full_name = full_name
             if email != user.email:
                 user.email = email
@@ -287,8 +350,8 @@ async def edit_profile(request: Request, db: Session = Depends(get_db)):
                     "success",
                     "Email обновлён. Подтвердите адрес" + ("" if sent else f": {link}"),
                 )
-            if new_password:
-                user.set_password(new_password)
+            if password_hash:
+                user.password_hash = password_hash
                 flash(request, "success", "Пароль обновлён.")
             db.commit()
             return RedirectResponse(url=request.url_for("profile"), status_code=303)
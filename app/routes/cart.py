@@ -1,9 +1,17 @@
+import logging
+from datetime import datetime, timedelta
+
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..booking import book_orders, release_orders, settle_payment
+from ..config import HOLD_TTL_MINUTES
 from ..database import get_db
-from ..models import Item, Order
+from ..models import Order
+from ..snapshot import get_snapshot
+from ..statuses import OrderStatus, PaymentStatus, payment_status_from_name
 from ..utils import (
     calculate_rental_price,
     check_item_availability,
@@ -11,29 +19,36 @@ from ..utils import (
     fetch_payment_status,
     flash,
     build_absolute_url,
+    ensure_csrf,
     get_cart,
     get_current_user,
     parse_datetime_local,
     parse_form_data,
     render,
+    rotate_session_id,
     save_cart,
 )
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
 @router.post("/cart/add/{item_id}")
 async def cart_add(request: Request, item_id: int, db: Session = Depends(get_db)):
-    item = db.query(Item).filter(Item.id == item_id).first()
+    item = get_snapshot(db).items.get(item_id)
     if not item:
         flash(request, "error", "Товар не найден.")
         return RedirectResponse(url=request.url_for("index"), status_code=303)
     form_raw = await request.form()
     form = parse_form_data(form_raw)
-    from ..utils import ensure_csrf
-
-    if not ensure_csrf(request, form):
+    # Страница товара для анонимного посетителя берётся из общего кеша с токеном без сессии.
+    # Для корзины он допустим: подделанный запрос лишь положит товар в новую пустую сессию,
+    # которую здесь же и заводим; вход, регистрация и оплата такой токен не принимают.
+    if not ensure_csrf(request, form, allow_anonymous=True):
         return RedirectResponse(url=request.url_for("item_detail", item_id=item.id), status_code=303)
+    if not request.session.get("_sid"):
+        rotate_session_id(request)
 
     start_at = form.get("start_at", "").strip()
     end_at = form.get("end_at", "").strip()
@@ -53,7 +68,7 @@ async def cart_add(request: Request, item_id: int, db: Session = Depends(get_db)
     cart = get_cart(request)
     if isinstance(cart, dict):
         cart = []
-    conflict = check_item_availability(item.id, start_dt, end_dt, db, cart)
+    conflict = check_item_availability(item.id, start_dt, end_dt, db, cart, qty=qty)
     if conflict:
         flash(request, "error", conflict)
         return RedirectResponse(url=request.url_for("item_detail", item_id=item.id), status_code=303)
@@ -77,8 +92,6 @@ async def cart_remove(request: Request, item_id: int):
         cart = []
     form_raw = await request.form()
     form = parse_form_data(form_raw)
-    from ..utils import ensure_csrf
-
     if not ensure_csrf(request, form):
         return RedirectResponse(url=request.url_for("cart"), status_code=303)
     try:
@@ -98,8 +111,6 @@ async def cart_remove(request: Request, item_id: int):
 async def checkout(request: Request, db: Session = Depends(get_db)):
     form_raw = await request.form()
     form = parse_form_data(form_raw)
-    from ..utils import ensure_csrf
-
     if not ensure_csrf(request, form):
         return RedirectResponse(url=request.url_for("cart"), status_code=303)
 
@@ -113,12 +124,19 @@ async def checkout(request: Request, db: Session = Depends(get_db)):
         flash(request, "error", "Нужно авторизоваться, чтобы оформить заказ.")
         return RedirectResponse(url=request.url_for("login"), status_code=303)
 
-    item_ids = [entry.get("item_id") for entry in cart if entry.get("item_id")]
-    items = {item.id: item for item in db.query(Item).filter(Item.id.in_(item_ids)).all()}
+    customer_email = user.email if getattr(user, "email", None) else None
+    if not customer_email:
+        flash(request, "error", "Не указан email для счета. Добавьте email в профиле и повторите.")
+        return RedirectResponse(url=request.url_for("cart"), status_code=303)
+
+    # цены для счёта — из снимка каталога, наличие проверяет book_orders по БД
+    items = get_snapshot(db).items
     total = 0
     orders_to_create = []
+    # неоплаченный заказ держит слот ограниченное время, потом слот снова свободен
+    hold_expires_at = datetime.utcnow() + timedelta(minutes=HOLD_TTL_MINUTES)
 
-    for idx, entry in enumerate(cart):
+    for entry in cart:
         item = items.get(entry.get("item_id"))
         if not item:
             continue
@@ -134,65 +152,64 @@ async def checkout(request: Request, db: Session = Depends(get_db)):
         if not start_dt or not end_dt or end_dt <= start_dt:
             flash(request, "error", "Не удалось разобрать даты аренды. Проверьте период и повторите.")
             return RedirectResponse(url=request.url_for("cart"), status_code=303)
-        conflict = check_item_availability(item.id, start_dt, end_dt, db, cart, skip_cart_idx=idx)
-        if conflict:
-            flash(request, "error", conflict)
-            return RedirectResponse(url=request.url_for("cart"), status_code=303)
         line_total, start_dt, end_dt, _ = calculate_rental_price(item, start_at, end_at, qty)
         date_from = start_dt.strftime("%Y-%m-%d")
         date_to = end_dt.strftime("%Y-%m-%d")
         order = Order(
             date_from=date_from,
             date_to=date_to,
-            status="ожидание оплаты",
-            payment_status="pending",
+            status_code=OrderStatus.AWAITING_PAYMENT,
+            payment_code=PaymentStatus.PENDING,
             user_id=user.id,
             item_id=item.id,
             start_at=start_dt.strftime("%Y-%m-%d %H:%M"),
             end_at=end_dt.strftime("%Y-%m-%d %H:%M"),
+            hold_expires_at=hold_expires_at,
+            qty=qty,
         )
-        orders_to_create.append((order, line_total))
+        orders_to_create.append(order)
         total += line_total
 
     if not orders_to_create:
         flash(request, "error", "Нет валидных позиций для оформления.")
         return RedirectResponse(url=request.url_for("cart"), status_code=303)
 
-    for order, _ in orders_to_create:
-        db.add(order)
-    db.flush()
+    # Слоты закрепляются отдельной короткой транзакцией до обращения в ЮKassa:
+    # блокировка записи не держится во время сетевого запроса. Ожидание блокировки (до
+    # SQLITE_BUSY_TIMEOUT) идёт в пуле потоков, а не в цикле событий.
+    order_ids, conflict = await run_in_threadpool(book_orders, orders_to_create)
+    if conflict:
+        flash(request, "error", conflict)
+        return RedirectResponse(url=request.url_for("cart"), status_code=303)
 
     payment = None
     try:
-        order_ids_str = ",".join(str(order.id) for order, _ in orders_to_create)
+        order_ids_str = ",".join(str(order_id) for order_id in order_ids)
         return_url = f"{build_absolute_url(request, 'payment_return')}?orders={order_ids_str}"
         metadata = {"order_ids": order_ids_str, "user_id": str(user.id)}
-        customer_email = user.email if getattr(user, "email", None) else None
-        if not customer_email:
-            flash(request, "error", "Не указан email для счета. Добавьте email в профиле и повторите.")
-            return RedirectResponse(url=request.url_for("cart"), status_code=303)
         payment = create_payment_invoice(
             total,
-            f"Аренда #{orders_to_create[0][0].id}",
+            f"Аренда #{order_ids[0]}",
             return_url=return_url,
             metadata=metadata,
             customer_email=customer_email,
         )
     except Exception as exc:
         error_text = f"{exc}"
-        print(f"PAYMENT CREATE ERROR: {error_text}")
+        logger.exception("payment create error: %s", error_text)
         flash(request, "error", f"Не удалось создать счёт в ЮKassa: {error_text}")
 
     if payment:
         payment_id, confirmation_url = payment
-        for order, _ in orders_to_create:
-            order.payment_id = payment_id
-            order.payment_status = "pending"
+        db.query(Order).filter(Order.id.in_(order_ids)).update(
+            {Order.payment_id: payment_id, Order.payment_code: PaymentStatus.PENDING},
+            synchronize_session=False,
+        )
         db.commit()
         save_cart(request, [])
         return RedirectResponse(url=confirmation_url, status_code=303)
 
-    db.rollback()
+    await run_in_threadpool(release_orders, order_ids)
     flash(request, "error", "Не удалось создать счёт в ЮKassa. Попробуйте позже или свяжитесь с поддержкой.")
     return RedirectResponse(url=request.url_for("cart"), status_code=303)
 
@@ -209,21 +226,21 @@ async def payment_return(request: Request, payment_id: str = "", orders: str = "
         return RedirectResponse(url=request.url_for("profile"), status_code=303)
 
     status = fetch_payment_status(payment_id)
-    orders_db = db.query(Order).filter(Order.payment_id == payment_id).all()
-    if not orders_db:
+    has_orders = db.query(Order.id).filter(Order.payment_id == payment_id).first()
+    if not has_orders:
         flash(request, "error", "Связанные заказы не найдены.")
         return RedirectResponse(url=request.url_for("profile"), status_code=303)
 
-    if status:
-        for order in orders_db:
-            order.payment_status = status
-            if status == "succeeded":
-                order.status = "оплачено"
-            elif status == "canceled":
-                order.status = "отменено"
-        db.commit()
+    payment_code = payment_status_from_name(status)
+    lost_orders = await run_in_threadpool(settle_payment, payment_id, payment_code) if payment_code else []
 
-    if status == "succeeded":
+    if lost_orders:
+        flash(
+            request,
+            "error",
+            "Оплата получена, но время брони истекло и слот уже занят. Мы свяжемся с вами для возврата средств.",
+        )
+    elif status == "succeeded":
         flash(request, "success", "Оплата прошла успешно.")
     elif status == "canceled":
         flash(request, "error", "Оплата отменена.")
@@ -239,7 +256,7 @@ async def cart(request: Request, db: Session = Depends(get_db)):
     cart_data = get_cart(request)
     if isinstance(cart_data, dict):
         cart_data = []
-    items_map = {item.id: item for item in db.query(Item).all()}
+    items_map = get_snapshot(db).items
     cart_items = []
     total = 0
     cleaned_cart = []
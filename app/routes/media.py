@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+from fastapi.responses import FileResponse, PlainTextResponse, Response
+
+from ..config import UPLOAD_ACCEL_PREFIX
+from ..storage import LocalStorage, get_storage
+
+router = APIRouter()
+
+# Имена загрузок — хеш содержимого, файл по адресу никогда не меняется
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@router.get(LocalStorage.url_prefix + "{key}", include_in_schema=False)
+def upload_file(key: str):
+    storage = get_storage()
+    path = storage.path(key) if isinstance(storage, LocalStorage) else None
+    if path is None or not path.is_file():
+        return PlainTextResponse("Not Found", status_code=404)
+    if UPLOAD_ACCEL_PREFIX:
+        # файл отдаёт nginx из internal location, воркер возвращает только заголовки
+        return Response(headers={"X-Accel-Redirect": UPLOAD_ACCEL_PREFIX + key, "Cache-Control": IMMUTABLE})
+    # при поддержке сервером расширения ASGI pathsend байты тоже не идут через Python
+    return FileResponse(path, headers={"Cache-Control": IMMUTABLE})
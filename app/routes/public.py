@@ -1,14 +1,21 @@
 from datetime import datetime
+from typing import Optional
 
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..booking import book_orders
+from ..catalog import CATALOG_SORTS, TARIFF_COLUMNS, catalog_page
+from ..config import PUBLIC_CACHE_SECONDS
 from ..database import get_db
-from ..models import Category, Item, Order
+from ..models import Order
+from ..snapshot import get_snapshot
+from ..statuses import BOOKED_ORDER_STATUSES, OrderStatus
+from ..suggest import MAX_SUGGEST_LIMIT, SUGGEST_LIMIT, get_index
 from ..utils import (
     calculate_rental_price,
-    check_item_availability,
     flash,
     get_cart,
     get_current_user,
@@ -16,6 +23,7 @@ from ..utils import (
     parse_form_data,
     render,
 )
+from .api import json_response
 
 router = APIRouter()
 
@@ -25,23 +33,43 @@ async def root_redirect(request: Request):
     return RedirectResponse(url=request.url_for("index"))
 
 
+def parse_price_filter(raw: str) -> Optional[int]:
+    raw = raw.strip()
+    if not raw.isdigit():
+        return None
+    return int(raw)
+
+
 @router.get("/catalog", name="index")
-async def index(request: Request, q: str = "", category: str = "", db: Session = Depends(get_db)):
+async def index(
+    request: Request,
+    q: str = "",
+    category: str = "",
+    sort: str = "",
+    tariff: str = "",
+    min_price: str = "",
+    max_price: str = "",
+    after: str = "",
+    db: Session = Depends(get_db),
+):
     user = get_current_user(request, db)
     q_norm = q.strip().lower()
-    categories = db.query(Category).order_by(Category.name).all()
-    items_query = db.query(Item)
-    if category:
-        items_query = items_query.filter(Item.category_id == int(category))
-    items = items_query.all()
-    if q_norm:
-        words = [w for w in q_norm.split() if w]
-        filtered = []
-        for item in items:
-            haystack = " ".join([item.name or "", item.short_description or "", item.description or ""]).lower()
-            if all(w in haystack for w in words):
-                filtered.append(item)
-        items = filtered
+    sort = sort if sort in CATALOG_SORTS else ""
+    tariff = tariff if tariff in TARIFF_COLUMNS else ""
+    price_from = parse_price_filter(min_price)
+    price_to = parse_price_filter(max_price)
+    snapshot = get_snapshot(db)
+    # карточке нужны только денормализованные поля: без картинок, заказов и описаний
+    items, next_cursor = catalog_page(
+        db,
+        category_id=int(category) if category else None,
+        q=q_norm,
+        sort=sort,
+        tariff=tariff,
+        min_price=price_from,
+        max_price=price_to,
+        after=after,
+    )
     return await render(
         request,
         "index.html",
@@ -50,16 +78,31 @@ async def index(request: Request, q: str = "", category: str = "", db: Session =
             "items": items,
             "q": q_norm,
             "category_id": int(category) if category else None,
-            "categories": categories,
+            "categories": snapshot.categories,
+            "sort": sort,
+            "tariff": tariff,
+            "min_price": price_from,
+            "max_price": price_to,
+            "next_url": str(request.url.include_query_params(after=next_cursor)) if next_cursor else None,
+            "first_url": str(request.url.remove_query_params("after")) if after else None,
             "current_user": user,
         },
+        cache_seconds=PUBLIC_CACHE_SECONDS,
     )
 
 
+@router.get("/catalog/suggest", name="catalog_suggest")
+async def catalog_suggest(request: Request, q: str = "", limit: int = SUGGEST_LIMIT, db: Session = Depends(get_db)):
+    # ответ из индекса в памяти; БД читается только при первой сборке после изменения каталога
+    payload = get_index(db).suggest(q[:100], max(1, min(limit, MAX_SUGGEST_LIMIT)))
+    return json_response(request, payload, cache_seconds=PUBLIC_CACHE_SECONDS)
+
+
 @router.api_route("/item/{item_id}", methods=["GET", "POST"])
 async def item_detail(request: Request, item_id: int, db: Session = Depends(get_db)):
     user = get_current_user(request, db)
-    item = db.query(Item).filter(Item.id == item_id).first()
+    # описание, цены и картинки — из снимка каталога; брони всегда читаются из БД
+    item = get_snapshot(db).items.get(item_id)
     if not item:
         return RedirectResponse(url=request.url_for("index"), status_code=302)
 
@@ -69,7 +112,7 @@ async def item_detail(request: Request, item_id: int, db: Session = Depends(get_
             Order.item_id == item_id,
             Order.start_at.isnot(None),
             Order.end_at.isnot(None),
-            Order.status.in_(["в обработке", "подтверждено", "оплачено"]),
+            Order.status_code.in_(BOOKED_ORDER_STATUSES),
         )
         .order_by(Order.start_at)
         .all()
@@ -105,24 +148,24 @@ async def item_detail(request: Request, item_id: int, db: Session = Depends(get_
                 flash(request, "error", "Окончание не может быть раньше или равно началу.")
                 return RedirectResponse(url=request.url_for("item_detail", item_id=item.id), status_code=303)
 
-            conflict = check_item_availability(item.id, start_dt, end_dt, db, get_cart(request))
-            if conflict:
-                flash(request, "error", conflict)
-                return RedirectResponse(url=request.url_for("item_detail", item_id=item.id), status_code=303)
-
-            date_from = start_at.split(" ")[0]
-            date_to = end_at.split(" ")[0]
+            try:
+                qty = max(1, int(form.get("qty", "1")))
+            except (TypeError, ValueError):
+                qty = 1
             order = Order(
-                date_from=date_from,
-                date_to=date_to,
-                status="в обработке",
+                date_from=start_dt.strftime("%Y-%m-%d"),
+                date_to=end_dt.strftime("%Y-%m-%d"),
+                status_code=OrderStatus.PROCESSING,
                 user_id=user.id,
                 item_id=item.id,
-                start_at=start_at,
-                end_at=end_at,
+                start_at=start_dt.strftime("%Y-%m-%d %H:%M"),
+                end_at=end_dt.strftime("%Y-%m-%d %H:%M"),
+                qty=qty,
             )
-            db.add(order)
-            db.commit()
+            _, conflict = await run_in_threadpool(book_orders, [order], cart=get_cart(request))
+            if conflict:
+                flash(request, "error", conflict)
+                return RedirectResponse(url=request.url_for("item_detail", item_id=item.id), status_code=303)
             flash(request, "success", "Бронирование создано.")
             return RedirectResponse(url=request.url_for("profile"), status_code=303)
 
@@ -130,4 +173,5 @@ async def item_detail(request: Request, item_id: int, db: Session = Depends(get_
         request,
         "item.html",
         {"request": request, "item": item, "current_user": user, "bookings": bookings},
+        cache_seconds=PUBLIC_CACHE_SECONDS,
     )
@@ -1,61 +1,184 @@
 from datetime import datetime, timedelta
 
-from sqlalchemy import or_, text
+from typing import Dict, List, Set
 
+from sqlalchemy import func, insert, inspect, or_, select, text
+
+from .analytics import backfill_booked_amounts, fill_booked_amounts
+from .catalog import rebuild_card_fields
 from .database import SessionLocal, engine
-from .models import Base, Category, Item, ItemImage, Order, User
+from .models import Base, Category, Item, ItemDailyStats, ItemImage, Order, OrderArchive, UploadRef, User
+from .statuses import LEGACY_ORDER_STATUSES, LEGACY_PAYMENT_STATUSES, OrderStatus
 
 
-def ensure_schema(db):
-    columns = {row[1] for row in db.execute(text("PRAGMA table_info(user)"))}
-    alters = []
-    if "role" not in columns:
-        alters.append("ALTER TABLE user ADD COLUMN role TEXT DEFAULT 'user'")
-    if "email_confirmed" not in columns:
-        alters.append("ALTER TABLE user ADD COLUMN email_confirmed BOOLEAN DEFAULT 0")
-    if "confirmation_token" not in columns:
-        alters.append("ALTER TABLE user ADD COLUMN confirmation_token TEXT")
-    if "reset_token" not in columns:
-        alters.append("ALTER TABLE user ADD COLUMN reset_token TEXT")
-    if "reset_token_expires_at" not in columns:
-        alters.append("ALTER TABLE user ADD COLUMN reset_token_expires_at DATETIME")
-    for statement in alters:
-        db.execute(text(statement))
-    if alters:
+def _case_sql(column: str, mapping: dict, default: str) -> str:
+    whens = " ".join(f"WHEN '{value}' THEN {int(code)}" for value, code in mapping.items())
+    return f"CASE {column} {whens} ELSE {default} END"
+
+
+def quote(db, name: str) -> str:
+    # "user" и "order" — зарезервированные слова; кавычки ставятся по правилам текущей СУБД
+    return db.get_bind().dialect.identifier_preparer.quote(name)
+
+
+def table_columns(db, table: str) -> Set[str]:
+    return {column["name"] for column in inspect(db.connection()).get_columns(table)}
+
+
+def add_missing_columns(db, table: str, columns: Dict[str, str]) -> List[str]:
+    # columns: имя -> ограничения и значение по умолчанию для ALTER TABLE ADD COLUMN. Тип берётся
+    # из модели и компилируется под диалект (DATETIME в SQLite, TIMESTAMP в PostgreSQL).
+    existing = table_columns(db, table)
+    dialect = db.get_bind().dialect
+    model = Base.metadata.tables[table]
+    added = [name for name in columns if name not in existing]
+    for name in added:
+        column_type = model.c[name].type.compile(dialect=dialect)
+        db.execute(
+            text(f"ALTER TABLE {quote(db, table)} ADD COLUMN {quote(db, name)} {column_type} {columns[name]}".rstrip())
+        )
+    if added:
         db.commit()
-    db.execute(text("UPDATE user SET role='user' WHERE role IS NULL"))
-    db.execute(text("UPDATE user SET email_confirmed=0 WHERE email_confirmed IS NULL"))
+    return added
+
+
+def migrate_order_statuses(db, has_payment_status: bool):
+    # текстовые статусы -> коды; DROP COLUMN требует SQLite 3.35+ (в Ubuntu 22.04 — 3.37)
+    order = quote(db, "order")
+    status_case = _case_sql("status", LEGACY_ORDER_STATUSES, str(int(OrderStatus.PROCESSING)))
+    db.execute(text(f"UPDATE {order} SET status_code = {status_case}"))
+    if has_payment_status:
+        payment_case = _case_sql("payment_status", LEGACY_PAYMENT_STATUSES, "NULL")
+        db.execute(text(f"UPDATE {order} SET payment_code = {payment_case}"))
+        db.execute(text(f"ALTER TABLE {order} DROP COLUMN payment_status"))
+    db.execute(text(f"ALTER TABLE {order} DROP COLUMN status"))
+    db.commit()
+
+
+def ensure_order_autoincrement(db):
+    # sqlite_autoincrement действует только при CREATE TABLE: в БД, созданных раньше, order — обычная
+    # rowid-таблица, и после архивации последних заказов их id выдаются снова. Пересоздаём таблицу
+    # с AUTOINCREMENT и ставим счётчик не ниже id, уже ушедших в архив. В PostgreSQL id из
+    # последовательности не повторяются и так.
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    table_sql = db.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'order'")).scalar()
+    if not table_sql or "AUTOINCREMENT" in table_sql.upper():
+        return
+    db.commit()
+    # DDL и копирование — одной транзакцией: при сбое остаётся прежняя таблица
+    db.execute(text("BEGIN IMMEDIATE"))
+    old_columns = table_columns(db, "order")
+    indexes = db.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'order' AND sql IS NOT NULL")
+    ).scalars().all()
+    for name in indexes:
+        db.execute(text(f"DROP INDEX {quote(db, name)}"))
+    db.execute(text('ALTER TABLE "order" RENAME TO order_rowid'))
+    Order.__table__.create(bind=db.connection())
+    columns = ", ".join(quote(db, column.name) for column in Order.__table__.columns if column.name in old_columns)
+    db.execute(text(f'INSERT INTO "order" ({columns}) SELECT {columns} FROM order_rowid'))
+    db.execute(text("DROP TABLE order_rowid"))
+    last_id = max(
+        db.query(func.max(Order.id)).scalar() or 0,
+        db.query(func.max(OrderArchive.id)).scalar() or 0,
+    )
+    db.execute(text("DELETE FROM sqlite_sequence WHERE name = 'order'"))
+    db.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('order', :seq)"), {"seq": last_id})
     db.commit()
 
-    order_columns = {row[1] for row in db.execute(text("PRAGMA table_info(`order`)"))}
-    order_alters = []
-    if "start_at" not in order_columns:
-        order_alters.append("ALTER TABLE `order` ADD COLUMN start_at TEXT")
-    if "end_at" not in order_columns:
-        order_alters.append("ALTER TABLE `order` ADD COLUMN end_at TEXT")
-    if "payment_id" not in order_columns:
-        order_alters.append("ALTER TABLE `order` ADD COLUMN payment_id TEXT")
-    if "payment_status" not in order_columns:
-        order_alters.append("ALTER TABLE `order` ADD COLUMN payment_status TEXT")
+
+def ensure_indexes():
+    # create_all не добавляет индексы к уже существующим таблицам
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def ensure_schema(db):
+    # Колонки, появившиеся после первых версий схемы. Без PRAGMA и диалектных кавычек:
+    # та же проверка работает и в SQLite, и в PostgreSQL.
+    add_missing_columns(
+        db,
+        "user",
+        {
+            "role": "DEFAULT 'user'",
+            "email_confirmed": "DEFAULT FALSE",
+            "confirmation_token": "",
+            "reset_token": "",
+            "reset_token_expires_at": "",
+        },
+    )
+    db.query(User).filter(User.role.is_(None)).update({User.role: "user"}, synchronize_session=False)
+    db.query(User).filter(User.email_confirmed.is_(None)).update(
+        {User.email_confirmed: False}, synchronize_session=False
+    )
+    db.commit()
+
+    order_columns = table_columns(db, "order")
+    add_missing_columns(
+        db,
+        "order",
+        {
+            "start_at": "",
+            "end_at": "",
+            "payment_id": "",
+            "status_code": f"NOT NULL DEFAULT {int(OrderStatus.PROCESSING)}",
+            "payment_code": "",
+            "hold_expires_at": "",
+            "qty": "NOT NULL DEFAULT 1",
+        },
+    )
     if "status" in order_columns:
-        db.execute(text("UPDATE `order` SET status='в обработке' WHERE status='pending'"))
-        db.execute(text("UPDATE `order` SET status='подтверждено' WHERE status='confirmed'"))
-    for statement in order_alters:
-        db.execute(text(statement))
-    if order_alters:
-        db.commit()
+        migrate_order_statuses(db, "payment_status" in order_columns)
+
+    add_missing_columns(
+        db,
+        "item",
+        {
+            "price_per_hour": "DEFAULT 0",
+            "price_per_3h": "DEFAULT 0",
+            "price_per_week": "DEFAULT 0",
+            "stock": "NOT NULL DEFAULT 1",
+        },
+    )
+    card_alters = add_missing_columns(
+        db,
+        "item",
+        {
+            "min_price": "",
+            "cover_image_url": "",
+            "image_count": "NOT NULL DEFAULT 0",
+            "active_booking_count": "NOT NULL DEFAULT 0",
+            "search_text": "NOT NULL DEFAULT ''",
+        },
+    )
 
-    item_columns = {row[1] for row in db.execute(text("PRAGMA table_info(item)"))}
-    item_alters = []
-    if "price_per_hour" not in item_columns:
-        item_alters.append("ALTER TABLE item ADD COLUMN price_per_hour INTEGER DEFAULT 0")
-    if "price_per_3h" not in item_columns:
-        item_alters.append("ALTER TABLE item ADD COLUMN price_per_3h INTEGER DEFAULT 0")
-    if "price_per_week" not in item_columns:
-        item_alters.append("ALTER TABLE item ADD COLUMN price_per_week INTEGER DEFAULT 0")
-    for statement in item_alters:
-        db.execute(text(statement))
-    if item_alters:
+    if add_missing_columns(db, "item_image", {"position": "NOT NULL DEFAULT 0"}):
+        # прежний порядок картинок определялся id
+        db.query(ItemImage).update({ItemImage.position: ItemImage.id}, synchronize_session=False)
+        db.commit()
+    booked_columns = {"booked_amount": "", "booked_hours": ""}
+    booked_alters = add_missing_columns(db, "order", booked_columns)
+    booked_alters += add_missing_columns(db, "order_archive", booked_columns)
+    if booked_alters:
+        # суммы прежних заказов — по текущим тарифам, как их уже учли дневные итоги
+        backfill_booked_amounts(db)
+        db.commit()
+    ensure_order_autoincrement(db)
+    if card_alters:
+        # поля карточек появились в уже заполненной БД — считаем их по товарам, картинкам и заказам
+        rebuild_card_fields(db)
+        db.commit()
+    if not db.query(UploadRef.url).first():
+        db.execute(
+            insert(UploadRef).from_select(
+                ["url", "refcount"],
+                select(ItemImage.url, func.count())
+                .where(ItemImage.url.like("/static/uploads/%"))
+                .group_by(ItemImage.url),
+            )
+        )
         db.commit()
 
 
@@ -141,7 +264,7 @@ def seed_data(db):
         order1 = Order(
             date_from="2025-11-25",
             date_to="2025-11-27",
-            status="подтверждено",
+            status_code=OrderStatus.CONFIRMED,
             user=demo_user,
             item=camera,
             start_at="2025-11-25 10:00",
@@ -150,13 +273,16 @@ def seed_data(db):
         order2 = Order(
             date_from="2025-12-01",
             date_to="2025-12-02",
-            status="в обработке",
+            status_code=OrderStatus.PROCESSING,
             user=demo_user,
             item=suit,
             start_at="2025-12-01 18:00",
             end_at="2025-12-02 10:00",
         )
         db.add_all([order1, order2])
+        db.flush()
+        fill_booked_amounts(db, [order1, order2])
+        rebuild_card_fields(db)
         db.commit()
 
     admin = db.query(User).filter(User.email == "admin123@example.com").first()
@@ -186,32 +312,25 @@ def init_db():
     Base.metadata.create_all(bind=engine)
     with SessionLocal() as db:
         ensure_schema(db)
+        ensure_indexes()
         seed_data(db)
+        stats_missing = not db.query(ItemDailyStats.day).first()
+        has_orders = db.query(Order.id).first() or db.query(OrderArchive.id).first()
+    if stats_missing and has_orders:
+        # таблица итогов появилась в уже работающей БД — заполняем по имеющимся заказам
+        from .analytics import rebuild_stats
+
+        rebuild_stats()
 
 
 import os
 
 
 def ensure_permissions():
-    db_path = os.path.join(os.path.dirname(__file__), "../rental.db")
+    # только для файла SQLite; правами на сервер PostgreSQL управляет сама СУБД
+    if engine.dialect.name != "sqlite" or not engine.url.database:
+        return
     try:
-        os.chown(db_path, 33, 33)  # www-data uid=33 gid=33
-    except PermissionError:
+        os.chown(engine.url.database, 33, 33)  # www-data uid=33 gid=33
+    except (PermissionError, FileNotFoundError):
         pass
-
-
-def migrate():
-    from .database import engine
-
-    with engine.connect() as conn:
-        # список миграций
-        migrations = [
-            "ALTER TABLE `order` ADD COLUMN payment_id TEXT",
-            "ALTER TABLE user ADD COLUMN email_verified INTEGER DEFAULT 0",
-        ]
-        for m in migrations:
-            try:
-                conn.execute(text(m))
-            except Exception:
-                # колонка уже существует
-                pass
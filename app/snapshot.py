@@ -0,0 +1,166 @@
+# Снимок каталога в памяти воркера: товары и категории как неизменяемые записи без ORM. Страница
+# товара, корзина, список категорий и подсказки читают его вместо БД. Снимок собирается целиком
+# и подменяется одной ссылкой, читатели не берут блокировок.
+# Отчёт о памяти и сравнение с ORM: python -m app.snapshot [--rounds N]
+import argparse
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import selectinload
+
+from .catalog import PRICE_FIELDS, on_catalog_change
+from .database import SessionLocal
+from .models import Category, Item, ItemImage
+
+
+class CategoryRecord(NamedTuple):
+    id: int
+    name: str
+
+
+class ItemRecord(NamedTuple):
+    # поля, которые читают шаблоны и calculate_rental_price; картинки — кортеж URL по position
+    id: int
+    name: str
+    category_id: Optional[int]
+    short_description: str
+    description: str
+    price_per_hour: int
+    price_per_3h: int
+    price_per_day: int
+    price_per_week: int
+    stock: int
+    min_price: Optional[int]
+    cover_image_url: Optional[str]
+    images: Tuple[str, ...]
+
+
+class CatalogSnapshot:
+    __slots__ = ("items", "categories", "built_at")
+
+    def __init__(self, items: Dict[int, ItemRecord], categories: Tuple[CategoryRecord, ...]):
+        self.items = items
+        self.categories = categories
+        self.built_at = time.time()
+
+
+ITEM_COLUMNS = (
+    Item.id,
+    Item.name,
+    Item.category_id,
+    Item.short_description,
+    Item.description,
+    *(getattr(Item, field) for field in PRICE_FIELDS),
+    Item.stock,
+    Item.min_price,
+)
+
+
+def build_snapshot(db) -> CatalogSnapshot:
+    # Три узких запроса без сущностей ORM. URL картинок и названия категорий интернируются:
+    # одна загрузка у нескольких товаров хранится одной строкой.
+    images: Dict[int, list] = {}
+    for item_id, url in db.query(ItemImage.item_id, ItemImage.url).order_by(
+        ItemImage.item_id, ItemImage.position, ItemImage.id
+    ):
+        images.setdefault(item_id, []).append(sys.intern(url))
+    items = {}
+    for row in db.query(*ITEM_COLUMNS).order_by(Item.id):
+        urls = tuple(images.get(row.id, ()))
+        items[row.id] = ItemRecord(
+            *row[:5],
+            *(price or 0 for price in row[5:9]),
+            row.stock if row.stock is not None else 1,
+            row.min_price,
+            urls[0] if urls else None,
+            urls,
+        )
+    categories = tuple(
+        CategoryRecord(row.id, sys.intern(row.name))
+        for row in db.query(Category.id, Category.name).order_by(Category.name)
+    )
+    return CatalogSnapshot(items, categories)
+
+
+_snapshot: Optional[CatalogSnapshot] = None
+_reload_lock = threading.Lock()
+
+
+def get_snapshot(db=None) -> CatalogSnapshot:
+    snapshot = _snapshot
+    if snapshot is not None:
+        return snapshot
+    return reload_snapshot(db)
+
+
+@on_catalog_change
+def reload_snapshot(db=None) -> CatalogSnapshot:
+    # Пересборки идут по очереди: каждая начинается после коммита, который её вызвал, поэтому
+    # последним подменяется самый свежий снимок
+    global _snapshot
+    with _reload_lock:
+        if db is not None:
+            snapshot = build_snapshot(db)
+        else:
+            with SessionLocal() as session:
+                snapshot = build_snapshot(session)
+        _snapshot = snapshot
+    return snapshot
+
+
+def measure_snapshot() -> Tuple[CatalogSnapshot, int]:
+    # Память, занятую снимком: разница tracemalloc до и после сборки (без кеша SQLAlchemy)
+    with SessionLocal() as db:
+        build_snapshot(db)  # прогрев: компиляция запросов не должна попасть в замер
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            snapshot = build_snapshot(db)
+            size = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+    return snapshot, size
+
+
+def benchmark(snapshot: CatalogSnapshot, rounds: int) -> Dict[str, float]:
+    # Микросекунды на товар: чтение записи из снимка против загрузки Item с картинками, как раньше
+    # делала страница товара (своя сессия на каждый товар — как отдельный HTTP-запрос)
+    ids = list(snapshot.items)
+    if not ids:
+        return {}
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for item_id in ids:
+            record = snapshot.items[item_id]
+            record.images
+    snapshot_us = (time.perf_counter() - started) / (rounds * len(ids)) * 1e6
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for item_id in ids:
+            with SessionLocal() as db:
+                item = db.query(Item).options(selectinload(Item.images)).filter(Item.id == item_id).first()
+                [image.url for image in item.images]
+    orm_us = (time.perf_counter() - started) / (rounds * len(ids)) * 1e6
+    return {"snapshot_us": snapshot_us, "orm_us": orm_us}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Размер снимка каталога и сравнение с чтением через ORM")
+    parser.add_argument("--rounds", type=int, default=20, help="повторов замера")
+    args = parser.parse_args(argv)
+    snapshot, size = measure_snapshot()
+    images = sum(len(record.images) for record in snapshot.items.values())
+    print(f"Товаров: {len(snapshot.items)}, категорий: {len(snapshot.categories)}, картинок: {images}")
+    per_item = f" ({size / len(snapshot.items):.0f} Б на товар)" if snapshot.items else ""
+    print(f"Память снимка: {size / 1024:.1f} КиБ{per_item}")
+    timings = benchmark(snapshot, max(1, args.rounds))
+    if timings:
+        print(f"Товар из снимка: {timings['snapshot_us']:.2f} мкс, через ORM: {timings['orm_us']:.1f} мкс")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import event
+
+from .context import current_context
+
+logger = logging.getLogger("app.sql")
+
+# Кольцевые буферы для /admin/diagnostics (последние события внутри процесса)
+slow_queries: deque = deque(maxlen=200)
+n_plus_one_reports: deque = deque(maxlen=100)
+
+_settings = {"slow_ms": 100.0, "n_plus_one": 10}
+
+
+class RequestTrace:
+    __slots__ = ("statements", "total_ms")
+
+    def __init__(self):
+        # statement -> [count, суммарное время в мс]
+        self.statements: Dict[str, List[float]] = {}
+        self.total_ms = 0.0
+
+    def add(self, statement: str, duration_ms: float) -> None:
+        stats = self.statements.get(statement)
+        if stats is None:
+            self.statements[statement] = [1, duration_ms]
+        else:
+            stats[0] += 1
+            stats[1] += duration_ms
+        self.total_ms += duration_ms
+
+
+def _shape(params) -> str:
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+    if isinstance(params, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+    return type(params).__name__
+
+
+def params_shape(parameters, executemany: bool) -> str:
+    if executemany and parameters:
+        return f"{len(parameters)} x {_shape(parameters[0])}"
+    if not parameters:
+        return "()"
+    return _shape(parameters)
+
+
+def _compact(statement: str) -> str:
+    return " ".join(statement.split())
+
+
+def _log(payload: dict) -> None:
+    logger.warning(payload["event"], extra={key: value for key, value in payload.items() if key != "event"})
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("sqltrace_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started_stack = conn.info.get("sqltrace_started")
+    if not started_stack:
+        return
+    duration_ms = (time.perf_counter() - started_stack.pop()) * 1000
+    ctx = current_context()
+    route = ctx.route if ctx is not None else "-"
+    if ctx is not None and ctx.sql_trace is not None:
+        ctx.sql_trace.add(statement, duration_ms)
+    slow = duration_ms >= _settings["slow_ms"]
+    if not slow and not logger.isEnabledFor(logging.DEBUG):
+        return
+    rowcount = getattr(cursor, "rowcount", -1)
+    record = {
+        "event": "slow_query" if slow else "query",
+        "at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "route": route,
+        "duration_ms": round(duration_ms, 2),
+        "rows": rowcount if rowcount is not None and rowcount >= 0 else None,
+        "params": params_shape(parameters, executemany),
+        "statement": _compact(statement),
+    }
+    if slow:
+        slow_queries.appendleft(record)
+        _log(record)
+    else:
+        logger.debug("query", extra={key: value for key, value in record.items() if key != "event"})
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("sqltrace_started"):
+        conn.info["sqltrace_started"].pop()
+
+
+def report_request(trace: RequestTrace, route: str, method: str) -> None:
+    threshold = _settings["n_plus_one"]
+    for statement, (count, total_ms) in trace.statements.items():
+        if count <= threshold:
+            continue
+        record = {
+            "event": "n_plus_one",
+            "at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            "route": route,
+            "method": method,
+            "count": int(count),
+            "total_ms": round(total_ms, 2),
+            "statement": _compact(statement),
+        }
+        n_plus_one_reports.appendleft(record)
+        _log(record)
+
+
+def install_sql_tracing(engine, slow_ms: float, n_plus_one: int) -> None:
+    _settings["slow_ms"] = slow_ms
+    _settings["n_plus_one"] = n_plus_one
+    if event.contains(engine, "before_cursor_execute", _before_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class SqlTraceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        ctx = current_context()
+        if scope["type"] != "http" or ctx is None:
+            await self.app(scope, receive, send)
+            return
+        trace = ctx.sql_trace = RequestTrace()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            report_request(trace, ctx.route, ctx.method)
+
+
+def snapshot() -> dict:
+    return {"slow": list(slow_queries), "n_plus_one": list(n_plus_one_reports), "settings": dict(_settings)}
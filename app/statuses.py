@@ -0,0 +1,71 @@
+from enum import IntEnum
+from typing import Optional
+
+
+class OrderStatus(IntEnum):
+    PROCESSING = 1
+    CONFIRMED = 2
+    AWAITING_PAYMENT = 3
+    PAID = 4
+    CANCELED = 5
+    EXPIRED = 6
+
+
+class PaymentStatus(IntEnum):
+    # коды статусов платежа YooKassa
+    PENDING = 1
+    WAITING_FOR_CAPTURE = 2
+    SUCCEEDED = 3
+    CANCELED = 4
+
+
+ORDER_STATUS_LABELS = {
+    OrderStatus.PROCESSING: "в обработке",
+    OrderStatus.CONFIRMED: "подтверждено",
+    OrderStatus.AWAITING_PAYMENT: "ожидание оплаты",
+    OrderStatus.PAID: "оплачено",
+    OrderStatus.CANCELED: "отменено",
+    OrderStatus.EXPIRED: "бронь истекла",
+}
+
+PAYMENT_STATUS_NAMES = {
+    PaymentStatus.PENDING: "pending",
+    PaymentStatus.WAITING_FOR_CAPTURE: "waiting_for_capture",
+    PaymentStatus.SUCCEEDED: "succeeded",
+    PaymentStatus.CANCELED: "canceled",
+}
+
+# Заказы, которые показываются как занятые слоты на странице товара
+BOOKED_ORDER_STATUSES = (OrderStatus.PROCESSING, OrderStatus.CONFIRMED, OrderStatus.PAID)
+
+# Заказы, которые после окончания аренды можно переносить в архив
+ARCHIVABLE_ORDER_STATUSES = (OrderStatus.CONFIRMED, OrderStatus.PAID, OrderStatus.CANCELED, OrderStatus.EXPIRED)
+
+# Платёж ещё может прийти: заказы с такими кодами ждут settle_payment
+UNSETTLED_PAYMENT_CODES = (PaymentStatus.PENDING, PaymentStatus.WAITING_FOR_CAPTURE)
+
+# Текстовые значения из старой схемы (включая совсем старые английские)
+LEGACY_ORDER_STATUSES = {
+    **{label: code for code, label in ORDER_STATUS_LABELS.items()},
+    "pending": OrderStatus.PROCESSING,
+    "confirmed": OrderStatus.CONFIRMED,
+}
+LEGACY_PAYMENT_STATUSES = {name: code for code, name in PAYMENT_STATUS_NAMES.items()}
+
+
+def order_status_label(code: Optional[int]) -> str:
+    if code is None:
+        return ""
+    return ORDER_STATUS_LABELS.get(code, "")
+
+
+def payment_status_name(code: Optional[int]) -> Optional[str]:
+    if code is None:
+        return None
+    return PAYMENT_STATUS_NAMES.get(code)
+
+
+def payment_status_from_name(name: Optional[str]) -> Optional[PaymentStatus]:
+    if not name:
+        return None
+    return LEGACY_PAYMENT_STATUSES.get(name)
@@ -0,0 +1,132 @@
+import mimetypes
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from .config import (
+    UPLOAD_BACKEND,
+    UPLOAD_DIR,
+    UPLOAD_S3_BUCKET,
+    UPLOAD_S3_ENDPOINT,
+    UPLOAD_S3_PREFIX,
+    UPLOAD_S3_PUBLIC_URL,
+    UPLOAD_S3_REGION,
+)
+
+# Ключ — имя файла без каталогов: хеш содержимого (или старое случайное имя) и расширение
+KEY_RE = re.compile(r"^[A-Za-z0-9_-]+(\.[A-Za-z0-9]+)?$")
+
+
+class LocalStorage:
+    url_prefix = "/static/uploads/"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path(self, key: str) -> Optional[Path]:
+        if not KEY_RE.match(key):
+            return None
+        return self.root / key
+
+    def save(self, key: str, content: bytes) -> None:
+        dest = self.root / key
+        if dest.exists():
+            # тот же хеш — то же содержимое; обновляем mtime, чтобы сборщик мусора не удалил файл
+            os.utime(dest)
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{key}.{os.getpid()}.tmp"
+        tmp.write_bytes(content)
+        os.replace(tmp, dest)
+
+    def delete(self, key: str) -> None:
+        (self.root / key).unlink(missing_ok=True)
+
+    def modified(self, key: str) -> Optional[float]:
+        try:
+            return (self.root / key).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def list(self) -> Iterator[Tuple[str, float]]:
+        if not self.root.exists():
+            return
+        for path in self.root.iterdir():
+            if path.is_file() and KEY_RE.match(path.name):
+                yield path.name, path.stat().st_mtime
+
+
+class S3Storage:
+    def __init__(self, bucket: str, prefix: str, endpoint: str, region: str, public_url: str):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("UPLOAD_BACKEND=s3 требует пакет boto3")
+        # ключи доступа — из стандартных переменных AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY
+        self.client = boto3.client("s3", endpoint_url=endpoint or None, region_name=region or None)
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+        base = public_url or f"{endpoint.rstrip('/')}/{bucket}/"
+        self.url_prefix = base.rstrip("/") + "/" + prefix
+
+    def save(self, key: str, content: bytes) -> None:
+        name = self.prefix + key
+        content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=name)
+        except self.client_error:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=name,
+                Body=content,
+                ContentType=content_type,
+                CacheControl="public, max-age=31536000, immutable",
+            )
+            return
+        # объект уже есть: копия на себя на стороне хранилища обновляет LastModified для сборщика мусора
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=name,
+            CopySource={"Bucket": self.bucket, "Key": name},
+            MetadataDirective="REPLACE",
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable",
+        )
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def modified(self, key: str) -> Optional[float]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.client_error:
+            return None
+        return head["LastModified"].timestamp()
+
+    def list(self) -> Iterator[Tuple[str, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"][len(self.prefix):]
+                if KEY_RE.match(key):
+                    modified: datetime = obj["LastModified"]
+                    yield key, modified.timestamp()
+
+
+_storage = None
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        if UPLOAD_BACKEND == "s3":
+            _storage = S3Storage(
+                UPLOAD_S3_BUCKET, UPLOAD_S3_PREFIX, UPLOAD_S3_ENDPOINT, UPLOAD_S3_REGION, UPLOAD_S3_PUBLIC_URL
+            )
+        else:
+            _storage = LocalStorage(UPLOAD_DIR)
+    return _storage
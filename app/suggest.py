@@ -0,0 +1,94 @@
+# Подсказки для строки поиска: названия товаров и категорий по префиксу. Индекс — отсортированные
+# массивы ключей в памяти воркера, поиск — bisect, без обращения к БД. Ключи — название, начиная
+# с каждого слова ("canon eos r", "eos r", "r"), поэтому "eos" тоже находит "Canon EOS R".
+import bisect
+import unicodedata
+from typing import Iterable, List, Optional, Tuple
+
+from .snapshot import CatalogSnapshot, get_snapshot
+
+SUGGEST_LIMIT = 8
+MAX_SUGGEST_LIMIT = 20
+
+
+def normalize(text: str) -> str:
+    # регистр, ё/е и пробелы: "Ёлочная  ГИРЛЯНДА" и "елочная гирлянда" — один ключ
+    text = unicodedata.normalize("NFC", text or "").casefold().replace("ё", "е")
+    return " ".join(text.split())
+
+
+class PrefixIndex:
+    # keys отсортированы; refs[i] — номер названия в names для keys[i]. Совпадения с начала
+    # названия лежат в отдельном массиве и выдаются первыми.
+    __slots__ = ("names", "keys", "refs", "head_keys", "head_refs")
+
+    def __init__(self, rows: Iterable[Tuple[int, str]]):
+        self.names: List[Tuple[int, str]] = []
+        heads = []
+        words = []
+        for row_id, name in rows:
+            ref = len(self.names)
+            self.names.append((row_id, name))
+            parts = normalize(name).split()
+            if not parts:
+                continue
+            heads.append((" ".join(parts), ref))
+            for pos in range(1, len(parts)):
+                words.append((" ".join(parts[pos:]), ref))
+        heads.sort()
+        words.sort()
+        self.head_keys = [key for key, _ in heads]
+        self.head_refs = [ref for _, ref in heads]
+        self.keys = [key for key, _ in words]
+        self.refs = [ref for _, ref in words]
+
+    def search(self, prefix: str, limit: int) -> List[Tuple[int, str]]:
+        found: List[int] = []
+        for keys, refs in ((self.head_keys, self.head_refs), (self.keys, self.refs)):
+            pos = bisect.bisect_left(keys, prefix)
+            # просмотр идёт только по совпадениям и заканчивается на limit-м новом названии
+            while pos < len(keys) and len(found) < limit and keys[pos].startswith(prefix):
+                if refs[pos] not in found:
+                    found.append(refs[pos])
+                pos += 1
+        return [self.names[ref] for ref in found]
+
+
+class SuggestIndex:
+    __slots__ = ("items", "categories")
+
+    def __init__(self, items: Iterable[Tuple[int, str]], categories: Iterable[Tuple[int, str]]):
+        self.items = PrefixIndex(items)
+        self.categories = PrefixIndex(categories)
+
+    def suggest(self, q: str, limit: int = SUGGEST_LIMIT) -> dict:
+        prefix = normalize(q)
+        if not prefix:
+            return {"items": [], "categories": []}
+        return {
+            "items": [{"id": row_id, "name": name} for row_id, name in self.items.search(prefix, limit)],
+            "categories": [{"id": row_id, "name": name} for row_id, name in self.categories.search(prefix, limit)],
+        }
+
+
+def build_index(snapshot: CatalogSnapshot) -> SuggestIndex:
+    return SuggestIndex(
+        ((record.id, record.name) for record in snapshot.items.values()),
+        ((record.id, record.name) for record in snapshot.categories),
+    )
+
+
+# Индекс строится из снимка каталога (app/snapshot.py) при первом запросе к новому снимку: после
+# правок в админке и импорта снимок подменяется, и индекс пересобирается вслед за ним. Новый индекс
+# подменяет старый целиком, поэтому читатели не видят наполовину обновлённые массивы.
+_cached: Tuple[Optional[CatalogSnapshot], Optional[SuggestIndex]] = (None, None)
+
+
+def get_index(db) -> SuggestIndex:
+    global _cached
+    snapshot = get_snapshot(db)
+    built_for, index = _cached
+    if built_for is not snapshot or index is None:
+        index = build_index(snapshot)
+        _cached = (snapshot, index)
+    return index
@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import func
+
+from .config import ALLOWED_IMAGE_EXT, MAX_UPLOAD_SIZE, UPLOAD_GC_GRACE_SECONDS
+from .database import SessionLocal
+from .models import ItemImage, UploadRef
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def upload_key(content: bytes, ext: str) -> str:
+    # Имя по содержимому: одинаковые файлы хранятся один раз, а URL никогда не меняет смысл
+    return hashlib.sha256(content).hexdigest()[:32] + ext
+
+
+def save_uploads(files: List[UploadFile]) -> List[str]:
+    storage = get_storage()
+    saved_urls: List[str] = []
+    for file in files:
+        if not file or not file.filename:
+            continue
+        ext = (Path(file.filename).suffix or "").lower()
+        if ext and ext not in ALLOWED_IMAGE_EXT:
+            continue
+        # читаем на байт больше лимита, чтобы не тянуть в память слишком большой файл целиком
+        content = file.file.read(MAX_UPLOAD_SIZE + 1)
+        if len(content) > MAX_UPLOAD_SIZE:
+            continue
+        key = upload_key(content, ext)
+        storage.save(key, content)
+        saved_urls.append(storage.url_prefix + key)
+    return saved_urls
+
+
+def change_upload_refs(db, added: Iterable[str] = (), removed: Iterable[str] = ()) -> None:
+    # Учитываются только свои загрузки; внешние URL счётчиков не имеют. Коммит — за вызывающим,
+    # вместе с изменением самих картинок.
+    prefix = get_storage().url_prefix
+    delta: Counter = Counter()
+    for url in added:
+        if url.startswith(prefix):
+            delta[url] += 1
+    for url in removed:
+        if url.startswith(prefix):
+            delta[url] -= 1
+    for url, change in delta.items():
+        if not change:
+            continue
+        ref = db.get(UploadRef, url)
+        if ref is None:
+            db.add(UploadRef(url=url, refcount=max(change, 0)))
+        else:
+            ref.refcount = max(ref.refcount + change, 0)
+
+
+def collect_orphaned_uploads(now: Optional[float] = None) -> int:
+    # Удаляет файлы старше грейс-периода, на которые нет ссылок. Каждый кандидат (нет строки
+    # в upload_ref или счётчик 0) перед удалением сверяется с item_image: счётчик мог разойтись
+    # с картинками (ссылки до учёта, сбой между записями). Найденные ссылки восстанавливают счётчик.
+    now = now or time.time()
+    storage = get_storage()
+    removed = 0
+    with SessionLocal() as db:
+        for key, modified in list(storage.list()):
+            if now - modified < UPLOAD_GC_GRACE_SECONDS:
+                continue
+            url = storage.url_prefix + key
+            ref = db.get(UploadRef, url)
+            if ref is not None and ref.refcount > 0:
+                continue
+            references = db.query(func.count(ItemImage.id)).filter(ItemImage.url == url).scalar()
+            if references:
+                if ref is None:
+                    db.add(UploadRef(url=url, refcount=references))
+                else:
+                    ref.refcount = references
+                logger.warning("upload refcount resynced: %s -> %s", url, references, extra={"url": url})
+                continue
+            # Повторная загрузка того же содержимого после list() только обновляет mtime, а её
+            # item_image может быть ещё не закоммичен: перед удалением время проверяется заново
+            current = storage.modified(key)
+            if current is None or current > modified or now - current < UPLOAD_GC_GRACE_SECONDS:
+                continue
+            storage.delete(key)
+            if ref is not None:
+                db.delete(ref)
+            removed += 1
+        db.commit()
+    return removed
+
+
+async def upload_gc(interval: float) -> None:
+    while True:
+        try:
+            removed = await asyncio.to_thread(collect_orphaned_uploads)
+            if removed:
+                logger.info("removed %s orphaned uploads", removed, extra={"removed": removed})
+        except Exception:
+            logger.exception("upload gc failed")
+        await asyncio.sleep(interval)
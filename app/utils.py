@@ -1,23 +1,22 @@
+import hashlib
+import hmac
+import logging
 import math
 import secrets
-import smtplib
+import time
 from datetime import datetime, timedelta
-from email.message import EmailMessage
-from email.utils import formataddr
-from pathlib import Path
 from typing import List, Optional, Tuple
 from urllib.parse import urljoin, urlsplit
 from sqlalchemy import or_
-from yookassa import Configuration, Payment
 
 from fastapi import Request, UploadFile
 from fastapi.templating import Jinja2Templates
 
 from .config import (
-    ALLOWED_IMAGE_EXT,
     APP_BASE_URL,
     BASE_DIR,
-    MAX_UPLOAD_SIZE,
+    CSRF_TOKEN_TTL,
+    SESSION_SECRET,
     SMTP_FROM,
     SMTP_HOST,
     SMTP_PASSWORD,
@@ -29,6 +28,9 @@ from .config import (
     YOOKASSA_SECRET_KEY,
     YOOKASSA_SHOP_ID,
 )
+from .metrics import track_outbound
+
+logger = logging.getLogger(__name__)
 
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
@@ -40,31 +42,82 @@ def flash(request: Request, category: str, message: str) -> None:
 
 
 def consume_flash(request: Request):
-    return request.session.pop("_messages", [])
+    # пустую сессию не трогаем, чтобы ответ не получил Set-Cookie
+    if "_messages" not in request.session:
+        return []
+    return request.session.pop("_messages")
 
 
-async def render(request: Request, template_name: str, context: dict):
+async def render(request: Request, template_name: str, context: dict, cache_seconds: int = 0):
+    # Кешируемость решается по входящему запросу: consume_flash может опустошить сессию, но
+    # ответ тогда несёт сообщения и Set-Cookie конкретного посетителя
+    had_session = bool(request.session)
     context.setdefault("messages", consume_flash(request))
-    context.setdefault("csrf_token", get_csrf_token(request))
-    return templates.TemplateResponse(template_name, context)
+    public = bool(cache_seconds) and not had_session and not context["messages"]
+    # страницы с формами (не кешируемые) получают сессию и токен, привязанный к ней
+    context.setdefault("csrf_token", get_csrf_token(request, create_session=not cache_seconds))
+    response = templates.TemplateResponse(template_name, context)
+    if public and not request.session:
+        # без сессии страница одинакова для всех анонимных посетителей и ответ без Set-Cookie
+        response.headers["Cache-Control"] = f"public, max-age={cache_seconds}"
+        response.headers["Vary"] = "Cookie"
+    return response
+
+
+CSRF_WINDOW_SECONDS = 3600
+
+
+def rotate_session_id(request: Request) -> None:
+    # при входе/выходе — токены, выданные до смены пользователя, перестают действовать
+    request.session["_sid"] = secrets.token_hex(16)
+
 
+def _csrf_session_id(request: Request, create: bool = True) -> str:
+    session = request.session
+    if not session and not create:
+        # кешируемая страница для анонимного посетителя: общий токен на окно, сессия не создаётся.
+        # verify_csrf принимает такой токен только там, где это разрешено явно (allow_anonymous).
+        return ""
+    session.pop("_csrf", None)  # токен из старой схемы хранения
+    sid = session.get("_sid")
+    if not sid:
+        sid = secrets.token_hex(16)
+        session["_sid"] = sid
+    return sid
 
-def get_csrf_token(request: Request) -> str:
-    token = request.session.get("_csrf")
-    if not token:
-        token = secrets.token_hex(16)
-        request.session["_csrf"] = token
-    return token
 
+def _csrf_signature(session_id: str, window: int) -> str:
+    message = f"{session_id}:{window}".encode()
+    return hmac.new(SESSION_SECRET.encode(), message, hashlib.sha256).hexdigest()[:32]
 
-def verify_csrf(request: Request, form: dict) -> bool:
-    session_token = request.session.get("_csrf")
+
+def get_csrf_token(request: Request, create_session: bool = True) -> str:
+    window = int(time.time() // CSRF_WINDOW_SECONDS)
+    return f"{window:x}.{_csrf_signature(_csrf_session_id(request, create_session), window)}"
+
+
+def verify_csrf(request: Request, form: dict, allow_anonymous: bool = False) -> bool:
     form_token = form.get("_csrf")
-    return bool(session_token and form_token and session_token == form_token)
+    if not form_token or not isinstance(form_token, str) or "." not in form_token:
+        return False
+    window_raw, signature = form_token.split(".", 1)
+    try:
+        window = int(window_raw, 16)
+    except ValueError:
+        return False
+    age = time.time() - window * CSRF_WINDOW_SECONDS
+    if age < 0 or age > CSRF_TOKEN_TTL + CSRF_WINDOW_SECONDS:
+        return False
+    session_id = request.session.get("_sid", "") if request.session else ""
+    if not session_id and not allow_anonymous:
+        # общий анонимный токен одинаков для всех посетителей без сессии: с ним чужая страница
+        # могла бы отправить форму входа или регистрации от имени жертвы (login CSRF)
+        return False
+    return hmac.compare_digest(signature, _csrf_signature(session_id, window))
 
 
-def ensure_csrf(request: Request, form: dict) -> bool:
-    if verify_csrf(request, form):
+def ensure_csrf(request: Request, form: dict, allow_anonymous: bool = False) -> bool:
+    if verify_csrf(request, form, allow_anonymous):
         return True
     flash(request, "error", "Некорректный CSRF-токен. Обновите страницу и попробуйте снова.")
     return False
@@ -74,26 +127,6 @@ def parse_images(raw: str) -> List[str]:
     return [line.strip() for line in raw.splitlines() if line.strip()]
 
 
-def save_uploads(files: List[UploadFile]) -> List[str]:
-    saved_urls: List[str] = []
-    upload_dir = BASE_DIR / "static" / "uploads"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    for file in files:
-        if not file or not file.filename:
-            continue
-        ext = (Path(file.filename).suffix or "").lower()
-        if ext and ext not in ALLOWED_IMAGE_EXT:
-            continue
-        content = file.file.read()
-        if len(content) > MAX_UPLOAD_SIZE:
-            continue
-        name = f"{secrets.token_hex(8)}{ext}"
-        dest = upload_dir / name
-        dest.write_bytes(content)
-        saved_urls.append(f"/static/uploads/{name}")
-    return saved_urls
-
-
 def parse_int_field(value: str, default: int = 0) -> int:
     try:
         value_str = str(value).strip()
@@ -132,7 +165,7 @@ def generate_token() -> str:
 
 
 def send_email_debug(subject: str, recipient: str, body: str) -> None:
-    print(f"EMAIL TO {recipient} | {subject}\n{body}\n")
+    logger.info("email (debug) to %s | %s", recipient, subject, extra={"email_to": recipient, "email_body": body})
 
 
 def send_email(subject: str, recipient: str, body: str, html_body: str | None = None, sender_name: str = "MIPTORENT") -> bool:
@@ -141,6 +174,10 @@ def send_email(subject: str, recipient: str, body: str, html_body: str | None =
     if not SMTP_HOST or not SMTP_FROM:
         send_email_debug(subject, recipient, body)
         return False
+    import smtplib
+    from email.message import EmailMessage
+    from email.utils import formataddr
+
     try:
         msg = EmailMessage()
         msg["Subject"] = subject
@@ -151,22 +188,23 @@ def send_email(subject: str, recipient: str, body: str, html_body: str | None =
             msg.add_alternative(html_body, subtype="html")
 
         use_ssl = SMTP_SSL or SMTP_PORT == 465
-        if use_ssl:
-            with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT or 465, timeout=10) as server:
-                server.set_debuglevel(1 if SMTP_DEBUG else 0)
-                if SMTP_USER:
-                    server.login(SMTP_USER, SMTP_PASSWORD or "")
-                server.send_message(msg)
-        else:
-            with smtplib.SMTP(SMTP_HOST, SMTP_PORT or 25, timeout=10) as server:
-                server.set_debuglevel(1 if SMTP_DEBUG else 0)
-                if SMTP_USER:
-                    server.starttls()
-                    server.login(SMTP_USER, SMTP_PASSWORD or "")
-                server.send_message(msg)
+        with track_outbound("smtp"):
+            if use_ssl:
+                with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT or 465, timeout=10) as server:
+                    server.set_debuglevel(1 if SMTP_DEBUG else 0)
+                    if SMTP_USER:
+                        server.login(SMTP_USER, SMTP_PASSWORD or "")
+                    server.send_message(msg)
+            else:
+                with smtplib.SMTP(SMTP_HOST, SMTP_PORT or 25, timeout=10) as server:
+                    server.set_debuglevel(1 if SMTP_DEBUG else 0)
+                    if SMTP_USER:
+                        server.starttls()
+                        server.login(SMTP_USER, SMTP_PASSWORD or "")
+                    server.send_message(msg)
         return True
     except Exception as exc:
-        print(f"EMAIL SEND ERROR: {exc}")
+        logger.error("email send error: %s", exc, extra={"email_to": recipient})
         send_email_debug(subject, recipient, body)
         return False
 
@@ -203,6 +241,8 @@ def create_payment_invoice(amount_rub: int, description: str, return_url: str, m
         raise ValueError("YOOKASSA_SHOP_ID или YOOKASSA_SECRET_KEY не заданы")
     if amount_rub <= 0:
         raise ValueError("Сумма платежа должна быть больше нуля")
+    from yookassa import Configuration, Payment
+
     Configuration.account_id = YOOKASSA_SHOP_ID
     Configuration.secret_key = YOOKASSA_SECRET_KEY
     idempotence_key = secrets.token_hex(16)
@@ -227,7 +267,8 @@ def create_payment_invoice(amount_rub: int, description: str, return_url: str, m
                 }
             ],
         }
-    payment = Payment.create(payload, idempotence_key)
+    with track_outbound("yookassa"):
+        payment = Payment.create(payload, idempotence_key)
     confirmation_url = getattr(getattr(payment, "confirmation", None), "confirmation_url", None)
     if not confirmation_url:
         return None
@@ -237,9 +278,12 @@ def create_payment_invoice(amount_rub: int, description: str, return_url: str, m
 def fetch_payment_status(payment_id: str) -> Optional[str]:
     if not (YOOKASSA_SHOP_ID and YOOKASSA_SECRET_KEY) or not payment_id:
         return None
+    from yookassa import Configuration, Payment
+
     Configuration.account_id = YOOKASSA_SHOP_ID
     Configuration.secret_key = YOOKASSA_SECRET_KEY
-    payment = Payment.find_one(payment_id)
+    with track_outbound("yookassa"):
+        payment = Payment.find_one(payment_id)
     return getattr(payment, "status", None)
 
 
@@ -321,27 +365,86 @@ def parse_cart_dt(value: str) -> Optional[datetime]:
     return parse_datetime_local(value)
 
 
-def check_item_availability(item_id: int, start_dt: datetime, end_dt: datetime, db, cart: List[dict], skip_cart_idx: Optional[int] = None) -> Optional[str]:
-    from .models import Order
-
+def peak_usage(
+    intervals: List[Tuple[datetime, datetime, int]], start_dt: datetime, end_dt: datetime
+) -> Tuple[int, Optional[datetime], Optional[datetime]]:
+    # Заметающая прямая по концам интервалов [start, end): максимум одновременно занятых
+    # единиц внутри окна и отрезок, на котором он достигается. O(k log k) по числу интервалов.
+    events = []
+    for i_start, i_end, qty in intervals:
+        events.append((i_start, qty))
+        events.append((i_end, -qty))
+    events.sort(key=lambda event: event[0])
+    peak, peak_from, peak_to = 0, None, None
+    current = 0
+    for idx, (moment, delta) in enumerate(events):
+        current += delta
+        if idx + 1 == len(events):
+            break
+        next_moment = events[idx + 1][0]
+        # все события одного момента применяются до оценки отрезка
+        if next_moment == moment:
+            continue
+        if moment < end_dt and next_moment > start_dt and current > peak:
+            peak, peak_from, peak_to = current, moment, next_moment
+    return peak, peak_from, peak_to
+
+
+def check_item_availability(
+    item_id: int,
+    start_dt: datetime,
+    end_dt: datetime,
+    db,
+    cart: List[dict],
+    skip_cart_idx: Optional[int] = None,
+    qty: int = 1,
+) -> Optional[str]:
+    from .models import Item, Order
+    from .statuses import PaymentStatus
+
+    stock = db.query(Item.stock).filter(Item.id == item_id).scalar()
+    if stock is None:
+        stock = 1
+    if stock <= 0:
+        # stock = 0 — товар снят с аренды
+        return "Этот товар сейчас не сдаётся в аренду."
+    if qty > stock:
+        return f"Доступно не больше {stock} шт. этого товара."
+
+    now = datetime.utcnow()
+    # грубый отбор по датам (строки начинаются с ГГГГ-ММ-ДД в любом из форматов) идёт по индексу,
+    # точное пересечение проверяется ниже
     active_orders = (
-        db.query(Order)
+        db.query(Order.start_at, Order.end_at, Order.qty)
         .filter(
             Order.item_id == item_id,
             Order.start_at.isnot(None),
             Order.end_at.isnot(None),
-            or_(Order.payment_status.is_(None), Order.payment_status != 'canceled'),
+            Order.start_at < (end_dt + timedelta(days=1)).strftime("%Y-%m-%d"),
+            Order.end_at >= start_dt.strftime("%Y-%m-%d"),
+            or_(Order.payment_code.is_(None), Order.payment_code != PaymentStatus.CANCELED),
+            or_(Order.hold_expires_at.is_(None), Order.hold_expires_at > now),
         )
         .all()
     )
-    for order in active_orders:
-        o_start = parse_cart_dt(order.start_at)
-        o_end = parse_cart_dt(order.end_at)
+    booked: List[Tuple[datetime, datetime, int]] = []
+    for o_start_raw, o_end_raw, o_qty in active_orders:
+        o_start = parse_cart_dt(o_start_raw)
+        o_end = parse_cart_dt(o_end_raw)
         if not o_start or not o_end:
             continue
         if intervals_overlap(start_dt, end_dt, o_start, o_end):
-            return f"Этот товар уже занят другим пользователем: {format_dt(o_start)} — {format_dt(o_end)}."
+            booked.append((o_start, o_end, o_qty or 1))
+    peak, peak_from, peak_to = peak_usage(booked, start_dt, end_dt)
+    if peak + qty > stock:
+        if stock == 1:
+            return f"Этот товар уже занят другим пользователем: {format_dt(peak_from)} — {format_dt(peak_to)}."
+        return (
+            f"Недостаточно свободных единиц: {format_dt(peak_from)} — {format_dt(peak_to)} "
+            f"свободно {max(stock - peak, 0)} из {stock} шт."
+        )
 
+    in_cart = False
     for idx, entry in enumerate(cart):
         if skip_cart_idx is not None and idx == skip_cart_idx:
             continue
@@ -352,7 +455,21 @@ def check_item_availability(item_id: int, start_dt: datetime, end_dt: datetime,
         if not e_start or not e_end:
             continue
         if intervals_overlap(start_dt, end_dt, e_start, e_end):
-            return f"Вы уже выбрали этот товар: {format_dt(e_start)} — {format_dt(e_end)}."
+            try:
+                e_qty = max(1, int(entry.get("qty", 1)))
+            except (TypeError, ValueError):
+                e_qty = 1
+            booked.append((e_start, e_end, e_qty))
+            in_cart = True
+    if in_cart:
+        peak, peak_from, peak_to = peak_usage(booked, start_dt, end_dt)
+        if peak + qty > stock:
+            if stock == 1:
+                return f"Вы уже выбрали этот товар: {format_dt(peak_from)} — {format_dt(peak_to)}."
+            return (
+                f"С учётом корзины {format_dt(peak_from)} — {format_dt(peak_to)} "
+                f"свободно {max(stock - peak, 0)} из {stock} шт."
+            )
 
     return None
 
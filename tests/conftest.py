@@ -0,0 +1,83 @@
+# Тесты работают с отдельной БД: временный файл SQLite, если DATABASE_URL не задан
+# (DATABASE_URL=postgresql+psycopg://... — прогон на PostgreSQL, БД должна быть пустой или тестовой).
+# Переменная задаётся до импорта app: config читает окружение при импорте.
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+_tmp_dir = None
+if not os.environ.get("DATABASE_URL", "").strip():
+    _tmp_dir = tempfile.mkdtemp(prefix="rental-tests-")
+    _db_path = Path(_tmp_dir) / "rental.db"
+    _db_path.touch()
+    os.environ["DATABASE_URL"] = f"sqlite:///{_db_path}"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    from app.seed import init_db
+
+    init_db()
+    yield
+    if _tmp_dir:
+        from app.database import engine
+
+        engine.dispose()
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def user_id() -> int:
+    from app.database import SessionLocal
+    from app.models import User
+
+    with SessionLocal() as db:
+        return db.query(User.id).filter(User.email == "user@example.com").scalar()
+
+
+@pytest.fixture
+def make_item():
+    from app.database import SessionLocal
+    from app.models import Category, Item
+
+    def make(stock: int = 1, price_per_hour: int = 100) -> int:
+        with SessionLocal() as db:
+            category_id = db.query(Category.id).order_by(Category.id).limit(1).scalar()
+            item = Item(
+                name="Тестовый товар",
+                short_description="тест",
+                description="тест",
+                price_per_hour=price_per_hour,
+                stock=stock,
+                category_id=category_id,
+            )
+            db.add(item)
+            db.commit()
+            return item.id
+
+    return make
+
+
+@pytest.fixture
+def make_order():
+    from app.models import Order
+    from app.statuses import OrderStatus
+
+    def make(user_id: int, item_id: int, start: datetime, hours: int, qty: int = 1) -> Order:
+        end = start + timedelta(hours=hours)
+        return Order(
+            date_from=start.strftime("%Y-%m-%d"),
+            date_to=end.strftime("%Y-%m-%d"),
+            status_code=OrderStatus.PROCESSING,
+            user_id=user_id,
+            item_id=item_id,
+            start_at=start.strftime("%Y-%m-%d %H:%M"),
+            end_at=end.strftime("%Y-%m-%d %H:%M"),
+            qty=qty,
+        )
+
+    return make
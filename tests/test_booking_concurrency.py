@@ -0,0 +1,67 @@
+# Параллельные брони: проверка занятости и вставка идут под блокировкой (app/booking.py), поэтому
+# ни в один момент не занято больше единиц товара, чем есть в наличии.
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from app.booking import _lock_items, book_orders
+from app.database import SessionLocal, engine
+from app.models import Item, Order
+from app.utils import parse_cart_dt
+
+STOCK = 2
+THREADS = 16
+
+
+def peak_booked(item_id: int) -> int:
+    with SessionLocal() as db:
+        rows = db.query(Order.start_at, Order.end_at, Order.qty).filter(Order.item_id == item_id).all()
+    intervals = [(parse_cart_dt(start), parse_cart_dt(end), qty) for start, end, qty in rows]
+    # максимум достигается в начале какого-то интервала
+    return max(
+        (sum(qty for start, end, qty in intervals if start <= point < end) for point, _, _ in intervals),
+        default=0,
+    )
+
+
+def test_parallel_overlapping_bookings_do_not_exceed_stock(user_id, make_item, make_order):
+    item_id = make_item(stock=STOCK)
+    day = datetime(2030, 6, 1, 9, 0)
+    barrier = threading.Barrier(THREADS)
+
+    def book(n: int):
+        # окна по 3 часа со сдвигом на час: соседние потоки пересекаются
+        order = make_order(user_id, item_id, day + timedelta(hours=n % 5), 3, qty=2 if n % 4 == 0 else 1)
+        barrier.wait()
+        return book_orders([order])
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        results = list(pool.map(book, range(THREADS)))
+
+    booked = [ids for ids, conflict in results if not conflict]
+    rejected = [conflict for ids, conflict in results if conflict]
+    assert booked and rejected
+    assert all(len(ids) == 1 for ids in booked)
+    assert peak_booked(item_id) <= STOCK
+    with SessionLocal() as db:
+        assert db.query(Order).filter(Order.item_id == item_id).count() == len(booked)
+        assert db.query(Item.active_booking_count).filter(Item.id == item_id).scalar() == len(booked)
+
+
+def test_bookings_of_different_items_lock_independently(user_id, make_item, make_order):
+    # Пока открыта транзакция брони первого товара, бронь второго в PostgreSQL проходит сразу:
+    # блокируются только строки товаров. SQLite допускает одного писателя, BEGIN IMMEDIATE
+    # ставит в очередь брони всех товаров — тест фиксирует и это ограничение.
+    first, second = make_item(), make_item()
+    start = datetime(2030, 8, 1, 10, 0)
+    serialized = engine.dialect.name == "sqlite"
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        with SessionLocal() as db:
+            _lock_items(db, [first])
+            other = pool.submit(book_orders, [make_order(user_id, second, start, 2)])
+            same = pool.submit(book_orders, [make_order(user_id, first, start, 2)])
+            done, _ = wait([other, same], timeout=2)
+            assert done == (set() if serialized else {other})
+            db.rollback()
+        assert other.result(timeout=30)[1] is None
+        assert same.result(timeout=30)[1] is None
@@ -0,0 +1,53 @@
+# Сброс кешей между воркерами (app/invalidation.py): другой процесс меняет товар и поднимает версию
+# каталога, этот процесс видит изменение после poll() — в снимке, индексе подсказок и ETag ответа.
+import multiprocessing
+
+from fastapi.testclient import TestClient
+
+from app.invalidation import poll
+from app.main import app
+from app.snapshot import get_snapshot
+from app.suggest import get_index
+
+NEW_NAME = "Квадрокоптер Invalidation Test"
+
+
+def rename_item(item_id: int, name: str) -> None:
+    # выполняется в отдельном процессе (spawn): свои движок, снимок и версии кешей
+    from app.catalog import notify_catalog_changed
+    from app.database import SessionLocal
+    from app.models import Item
+
+    with SessionLocal() as db:
+        db.query(Item).filter(Item.id == item_id).update({Item.name: name})
+        db.commit()
+    notify_catalog_changed()
+
+
+def test_catalog_change_in_another_process_reaches_this_one():
+    poll(fire=False)
+    snapshot = get_snapshot()
+    item_id = min(snapshot.items)
+    client = TestClient(app)
+    url = app.url_path_for("catalog_suggest")
+    before = client.get(url, params={"q": NEW_NAME})
+    assert before.status_code == 200
+    assert before.json()["items"] == []
+    assert get_index(None).suggest(NEW_NAME)["items"] == []
+
+    process = multiprocessing.get_context("spawn").Process(target=rename_item, args=(item_id, NEW_NAME))
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+
+    # до опроса воркер отдаёт прежний снимок
+    assert get_snapshot() is snapshot
+    assert "catalog" in poll()
+
+    assert get_snapshot() is not snapshot
+    assert get_snapshot().items[item_id].name == NEW_NAME
+    assert get_index(None).suggest(NEW_NAME)["items"] == [{"id": item_id, "name": NEW_NAME}]
+    after = client.get(url, params={"q": NEW_NAME}, headers={"If-None-Match": before.headers["etag"]})
+    assert after.status_code == 200
+    assert after.headers["etag"] != before.headers["etag"]
+    assert after.json()["items"] == [{"id": item_id, "name": NEW_NAME}]